@@ -0,0 +1,83 @@
+"""
+Compares SSE payload size and server CPU per event for the two event formats.
+
+Replays the events of a typical three-step analysis through UserInteraction into
+a broker session, once with server-rendered HTML (default) and once with
+format=structured, then measures the bytes streamed per session and the CPU time
+spent producing and serializing each event. LLM summaries are canned so only
+formatting and serialization are measured.
+
+Usage:
+    uv run python benchmarks/bench_event_payloads.py [sessions]
+"""
+import asyncio
+import json
+import sys
+import time
+
+from stock_research.backend.message_broker import MessageBroker
+from stock_research.agent.userinteraction import userinteraction
+from stock_research.agent.userinteraction.userinteraction import UserInteraction
+
+STEPS = 3
+CANNED_SUMMARY = """Looked up the company's quarterly income figures in the research documents.
+<ul style="margin: 15px 0; padding-left: 20px;">
+    <li style="margin-bottom: 8px;">Revenue grew 18% year over year</li>
+    <li style="margin-bottom: 8px;">Operating margin improved to 21%</li>
+</ul>"""
+
+class CannedLLM:
+    async def generate_with_timeout(self, prompt):
+        return CANNED_SUMMARY
+
+    async def stream_with_timeout(self, prompt):
+        # The final summary streams; split the canned text into line-sized chunks
+        for line in CANNED_SUMMARY.splitlines(keepends=True):
+            yield line
+
+async def run_session(session_id: str, llm: CannedLLM):
+    await UserInteraction.send_update(session_id, "agent", "Processing query: Income growth for NH")
+    for step in range(STEPS):
+        await UserInteraction.send_update(session_id, "perception", "Intent: analyze income growth")
+        await UserInteraction.send_update(session_id, "memory", f"Retrieved {step} relevant data points")
+        await UserInteraction.send_update(session_id, "plan", "Generated analysis plan")
+        await UserInteraction.send_iteration_summary(
+            session_id, {"stage": "tool_execution", "tool_name": "search_documents", "result": "..."}, llm
+        )
+    await UserInteraction.send_update(
+        session_id, "agent", "done", is_final=True, raw_data={"result": "18%"}, query_type="analysis", llm_manager=llm
+    )
+
+async def bench(broker: MessageBroker, render_html: bool, sessions: int):
+    llm = CannedLLM()
+    events = 0
+    total_bytes = 0
+    start = time.process_time()
+    for _ in range(sessions):
+        session = broker.create_session(render_html=render_html)
+        await run_session(session.session_id, llm)
+        broker.close_session(session.session_id)
+        while (message := session.message_queue.get()) is not None:
+            events += 1
+            total_bytes += len(f"id: {session.session_id}:{message['id']}\ndata: {json.dumps(message)}\n\n")
+    elapsed = time.process_time() - start
+    return total_bytes / sessions, elapsed / events * 1e6
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    broker = MessageBroker()
+    userinteraction.message_broker = broker
+
+    results = {}
+    for name, render_html in (("html", True), ("structured", False)):
+        asyncio.run(bench(broker, render_html, 20))  # Warm up
+        results[name] = asyncio.run(bench(broker, render_html, sessions))
+        bytes_per_session, us_per_event = results[name]
+        print(f"{name:12s} {bytes_per_session:9.0f} bytes/session  {us_per_event:7.1f} us/event")
+
+    html_bytes, html_us = results["html"]
+    structured_bytes, structured_us = results["structured"]
+    print(f"reduction    {1 - structured_bytes / html_bytes:9.1%} bytes          {1 - structured_us / html_us:7.1%} cpu")
+
+if __name__ == "__main__":
+    main()
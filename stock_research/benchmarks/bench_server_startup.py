@@ -0,0 +1,50 @@
+"""
+Startup benchmark for the MCP servers.
+
+For each server and launcher ("uv" resolves the environment on every launch,
+"python" execs the backend's interpreter directly) this spawns a fresh process
+and reports time to session initialized and time to the first completed tool call.
+
+Usage:
+    uv run python benchmarks/bench_server_startup.py [server ...]
+"""
+import asyncio
+import sys
+import time
+
+from mcp import ClientSession
+from mcp.client.stdio import stdio_client
+
+from stock_research.backend.server_manager import mcp_server
+
+# A cheap, representative first call per server
+PROBES = {
+    'math': ('add', {'input': {'a': 1, 'b': 2}}),
+    'rag': ('search_documents', {'query': 'warm up'}),
+    'gmail': ('get-unread-emails', {})
+}
+
+async def time_to_first_call(server_name: str, launcher: str):
+    tool_name, arguments = PROBES[server_name]
+    started = time.perf_counter()
+    async with stdio_client(mcp_server.server_params(server_name, launcher)) as (read, write):
+        async with ClientSession(read, write) as session:
+            await asyncio.wait_for(session.initialize(), timeout=120)
+            initialized = time.perf_counter() - started
+            await asyncio.wait_for(session.call_tool(tool_name, arguments=arguments), timeout=120)
+            first_call = time.perf_counter() - started
+    return initialized, first_call
+
+async def main():
+    servers = sys.argv[1:] or list(PROBES)
+    print(f"{'server':8s} {'launcher':8s} {'initialized':>12s} {'first call':>12s}")
+    for server_name in servers:
+        for launcher in ("uv", "python"):
+            try:
+                initialized, first_call = await time_to_first_call(server_name, launcher)
+                print(f"{server_name:8s} {launcher:8s} {initialized:11.2f}s {first_call:11.2f}s")
+            except Exception as e:
+                print(f"{server_name:8s} {launcher:8s} failed: {e}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
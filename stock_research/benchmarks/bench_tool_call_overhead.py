@@ -0,0 +1,56 @@
+"""
+Microbenchmark for MCP tool-call dispatch overhead.
+
+Compares the two ways an agent run can reach the shared MCP loop:
+- before: a new thread + asyncio.run per query, every tool call hopping across loops
+- after: the query runs as a task on the shared loop and awaits the session directly
+
+Sessions are replaced with a no-op stub so only dispatch overhead is measured.
+
+Usage:
+    uv run python benchmarks/bench_tool_call_overhead.py [queries] [calls_per_query]
+"""
+import asyncio
+import sys
+import threading
+import time
+
+from stock_research.backend.server_manager import mcp_server
+
+class NullSession:
+    async def call_tool(self, name, arguments=None):
+        return None
+
+def attach_null_sessions():
+    for replicas in mcp_server.replicas.values():
+        for replica in replicas:
+            mcp_server._set_replica_state(replica, NullSession(), tools=[])
+
+async def run_query(calls: int):
+    for _ in range(calls):
+        await mcp_server.execute_command('math', lambda session: session.call_tool('noop'), session_id='bench')
+
+def thread_per_query(queries: int, calls: int):
+    for _ in range(queries):
+        thread = threading.Thread(target=lambda: asyncio.run(run_query(calls)))
+        thread.start()
+        thread.join()
+
+def shared_loop(queries: int, calls: int):
+    for _ in range(queries):
+        mcp_server.submit(run_query(calls)).result()
+
+def main():
+    queries = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    calls = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    attach_null_sessions()
+
+    for name, bench in (("thread + asyncio.run per query", thread_per_query), ("shared loop", shared_loop)):
+        bench(10, calls)  # Warm up
+        start = time.perf_counter()
+        bench(queries, calls)
+        elapsed = time.perf_counter() - start
+        print(f"{name:32s} {elapsed / queries * 1e6:9.1f} us/query  {elapsed / (queries * calls) * 1e6:7.1f} us/call")
+
+if __name__ == "__main__":
+    main()
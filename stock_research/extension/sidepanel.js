@@ -6,6 +6,19 @@ class StockResearchAssistant {
         this.typingIndicator = document.querySelector('.typing-indicator');
         this.statusIndicator = document.querySelector('.status');
         this.backendUrl = 'http://localhost:5000';
+        this.maxReconnectAttempts = 5;
+        // Ask for compact structured events and render them here instead of receiving server-built HTML
+        this.structuredEvents = true;
+        this.eventIcons = {
+            perception: '📋',
+            memory: '🔍',
+            plan: '📝',
+            tool: '⚙️',
+            agent: '🤖',
+            summary: '📊',
+            result: '🎯',
+            info: 'ℹ️'
+        };
         
         this.setupEventListeners();
         this.setupSuggestions();
@@ -41,7 +54,7 @@ class StockResearchAssistant {
 
     async checkServerStatus() {
         try {
-            const response = await fetch(`${this.backendUrl}/status`);
+            const response = await fetch(`${this.backendUrl}/status${this.formatParam('?')}`);
             const data = await response.json();
             
             if (data.status === 'ready') {
@@ -49,6 +62,8 @@ class StockResearchAssistant {
                 this.statusIndicator.className = 'status online';
                 if (data.html) {
                     this.addMessage(data.html, 'assistant');
+                } else if (this.structuredEvents) {
+                    this.addMessage(this.renderWelcome(), 'assistant');
                 }
                 this.enableInput();
             } else {
@@ -96,20 +111,44 @@ class StockResearchAssistant {
         this.showTypingIndicator();
 
         try {
-            const eventSource = new EventSource(`${this.backendUrl}/query?message=${encodeURIComponent(message)}`);
+            const eventSource = new EventSource(`${this.backendUrl}/query?message=${encodeURIComponent(message)}${this.formatParam('&')}`);
+            let reconnectAttempts = 0;
+            let lastEventId = '';
+            // Message growing with the final answer's partial events, replaced by the final event
+            let streaming = null;
+            let partialText = '';
             
             eventSource.onmessage = (event) => {
                 const data = JSON.parse(event.data);
+                lastEventId = event.lastEventId;
+                reconnectAttempts = 0;
+                
+                if (data.type === 'partial') {
+                    this.hideTypingIndicator();
+                    partialText += data.content !== undefined ? data.content : data.text;
+                    const content = this.renderPartial(partialText);
+                    if (streaming) {
+                        streaming.querySelector('.message-content').innerHTML = content;
+                        this.scrollToBottom();
+                    } else {
+                        streaming = this.addMessage(content, 'assistant');
+                    }
+                    return;
+                }
                 
                 if (data.type === 'update' || data.type === 'final') {
                     this.hideTypingIndicator();
                     
-                    // Create a temporary div to check if content is HTML
-                    const temp = document.createElement('div');
-                    temp.innerHTML = data.content;
+                    // Structured events carry no content; plain-text messages still do
+                    const content = data.content !== undefined ? data.content : this.renderEvent(data);
                     
-                    // Add the message
-                    this.addMessage(data.content, 'assistant');
+                    if (data.type === 'final' && streaming) {
+                        streaming.querySelector('.message-content').innerHTML = content;
+                        streaming = null;
+                    } else {
+                        // Updates arriving mid-stream go above the answer being written
+                        this.addMessage(content, 'assistant', streaming);
+                    }
                     
                     if (data.type === 'final') {
                         setTimeout(() => {
@@ -122,6 +161,13 @@ class StockResearchAssistant {
             };
 
             eventSource.onerror = (error) => {
+                // The browser reconnects on its own, sending Last-Event-ID so the
+                // backend replays the missed messages instead of rerunning the query
+                if (eventSource.readyState === EventSource.CONNECTING && lastEventId
+                        && reconnectAttempts < this.maxReconnectAttempts) {
+                    reconnectAttempts++;
+                    return;
+                }
                 console.error('EventSource failed:', error);
                 this.hideTypingIndicator();
                 this.addMessage('Sorry, there was an error processing your request.', 'assistant');
@@ -137,7 +183,52 @@ class StockResearchAssistant {
         }
     }
 
-    addMessage(content, type) {
+    formatParam(separator) {
+        return this.structuredEvents ? `${separator}format=structured` : '';
+    }
+
+    renderEvent(event) {
+        const icon = this.eventIcons[event.icon] || this.eventIcons.info;
+        const title = event.data && event.data.title;
+
+        // Summaries are LLM-generated HTML, inserted as-is just like server-rendered panels
+        if (title) {
+            const style = event.stage === 'final' ? 'final' : 'iteration';
+            return `<div class="event-panel ${style}"><div class="event-body"><div class="event-summary">
+                <h3><span class="step-icon">${icon}</span>${this.escapeHtml(title)}</h3>
+                <div class="event-text">${event.text}</div>
+            </div></div></div>`;
+        }
+        return `<div class="event-panel"><div class="event-body"><div class="event-step">
+            <span class="step-icon">${icon}</span>
+            <span class="event-text">${event.text}</span>
+        </div></div></div>`;
+    }
+
+    renderPartial(text) {
+        return `<div class="event-panel final"><div class="event-body"><div class="event-summary">
+            <h3><span class="step-icon">${this.eventIcons.result}</span>Writing results...</h3>
+            <div class="event-text">${text}</div>
+        </div></div></div>`;
+    }
+
+    renderWelcome() {
+        const capabilities = [
+            ['📊', 'Analyzing financial reports and market data'],
+            ['🧮', 'Performing complex mathematical calculations'],
+            ['📧', 'Managing and processing email communications'],
+            ['🔍', 'Searching and analyzing research documents']
+        ];
+        const items = capabilities
+            .map(([icon, text]) => `<div class="event-step"><span class="step-icon">${icon}</span><span class="event-text">${text}</span></div>`)
+            .join('');
+        return `<div class="event-panel final"><div class="event-body"><div class="event-summary">
+            <div class="event-step"><span class="step-icon">🤖</span><span class="event-text">Welcome! I'm your AI-powered Stock Research Assistant, designed to help you analyze financial data, process market information, and make informed investment decisions. I combine advanced mathematical capabilities with document processing and email management to provide comprehensive financial research support.</span></div>
+            <div><p>My capabilities include:</p>${items}</div>
+        </div></div></div>`;
+    }
+
+    addMessage(content, type, before = null) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${type}-message`;
         
@@ -160,8 +251,9 @@ class StockResearchAssistant {
         messageDiv.appendChild(messageContent);
         messageDiv.appendChild(timestamp);
         
-        this.chatContainer.appendChild(messageDiv);
+        this.chatContainer.insertBefore(messageDiv, before);
         this.scrollToBottom();
+        return messageDiv;
     }
 
     showTypingIndicator() {
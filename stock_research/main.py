@@ -1,5 +1,6 @@
 from stock_research.backend.app import app
 from stock_research.backend.message_broker import message_broker
+import argparse
 import webbrowser
 import threading
 import time
@@ -14,11 +15,22 @@ def open_chrome_extension():
     print("Please load the extension from the Chrome extensions page if not already loaded.")
 
 def main():
+    parser = argparse.ArgumentParser(description="Stock Research Assistant backend")
+    parser.add_argument("--asgi", action="store_true",
+                        help="Serve with the async (ASGI) backend instead of Flask")
+    args = parser.parse_args()
+
     print("Starting Stock Research Assistant...")
     
     # Start Chrome extension helper in background
     #threading.Thread(target=open_chrome_extension, daemon=True).start()
     
+    if args.asgi:
+        from stock_research.backend import asgi_app
+        print("Starting async backend server...")
+        asgi_app.run(host='127.0.0.1', port=5000)
+        return
+
     # Run Flask application
     print("Starting backend server...")
     app.run(
@@ -55,6 +55,18 @@ def parse_function_call(response: str) -> tuple[str, Dict[str, Any]]:
         raise
 
 
+def parse_function_calls(response: str) -> list[tuple[str, Dict[str, Any]]]:
+    """Parses every FUNCTION_CALL line of a plan, in order, into (tool name, arguments)."""
+    calls = [
+        parse_function_call(line.strip())
+        for line in response.splitlines()
+        if line.strip().startswith("FUNCTION_CALL:")
+    ]
+    if not calls:
+        raise ValueError("Not a valid FUNCTION_CALL")
+    return calls
+
+
 async def execute_tool(session: ClientSession, tools: list[Any], response: str) -> ToolCallResult:
     """Executes a FUNCTION_CALL via MCP tool session."""
     try:
@@ -2,17 +2,22 @@ import asyncio
 import time
 import os
 import datetime
-from .perception import extract_perception
+from .perception import extract_perception, cached_perception, refine_perception
 from .memory import MemoryManager, MemoryItem
-from .decision import generate_plan
+from .decision import generate_plan, MAX_PARALLEL_TOOL_CALLS
 from .action import execute_tool
 from mcp import ClientSession
 from typing import Optional
+from contextlib import contextmanager
 from .userinteraction.userinteraction import user_interaction
 from ..backend.message_broker import message_broker
+from ..backend.metrics import (
+    STAGE_SECONDS, QUERY_SECONDS, QUERIES_TOTAL, TOOL_CALL_SECONDS, TOOL_CALLS_TOTAL, LLM_CALLS_SAVED_TOTAL
+)
 from .llm.llm import LLMManager
 from .config.log_config import setup_logging
-from .action import parse_function_call
+from .action import parse_function_calls
+from .context import ContextBuilder, estimate_tokens
 
 #def log(stage: str, msg: str):
 #    """Simple console logging function"""
@@ -20,10 +25,38 @@ from .action import parse_function_call
 #    print(f"[{now}] [{stage}] {msg}")
 
 max_steps = 10
+# "compact" describes only the tools relevant to the perception's tool hint in full
+TOOL_CATALOG_MODE = os.getenv("TOOL_CATALOG_MODE", "full").lower()
+memory_dedup_threshold = 0.95  # Cosine similarity above which repeated tool outputs are not stored again
+
+class StepTimeline:
+    """Start and end offsets of each stage in one agent step, for spotting the critical path"""
+
+    def __init__(self, step: int):
+        self.step = step
+        self.started = time.perf_counter()
+        self.stages = []  # (name, start offset, end offset) in seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage into the timeline and the per-stage latency histogram"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            STAGE_SECONDS.observe(end - start, stage=name)
+            self.stages.append((name, start - self.started, end - self.started))
+
+    def summary(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        busy = sum(end - start for _, start, end in self.stages)
+        spans = ", ".join(f"{name} {start * 1000:.0f}-{end * 1000:.0f}ms" for name, start, end in sorted(self.stages, key=lambda s: s[1]))
+        return f"Step {self.step} timeline: {spans}; wall {elapsed * 1000:.0f}ms vs {busy * 1000:.0f}ms sequential"
 
 class Agent:
     def __init__(self):
-        self.memory = MemoryManager()
+        self.memory = MemoryManager(dedup_threshold=memory_dedup_threshold)
         self.logger = setup_logging(__name__)
         self.llm = LLMManager()
         self.llm.initialize()
@@ -34,6 +67,30 @@ class Agent:
         user_input: str,
         session_id: Optional[str] = None
     ):
+        # Counted per query: memory.stats is shared by every concurrent session
+        dedup_counts = {"added": 0, "skipped": 0, "merged": 0}
+        query_started = time.perf_counter()
+        outcome = "error"
+        answer = None  # Returned when the query is answered, for the answer cache
+        tool_calls_seen = []  # (tool_name, arguments) of every call
+        servers_used = set()
+        perception_saved = {"cache": 0, "refine": 0}
+        # Iteration summaries are cosmetic, so they run alongside the next steps
+        # and are only awaited before the final result is sent
+        summary_tasks = []
+
+        async def summarize(iteration_data: dict):
+            with STAGE_SECONDS.time(stage="summary"):
+                await user_interaction.send_iteration_summary(
+                    session_id=session_id,
+                    iteration_data=iteration_data,
+                    llm_manager=self.llm
+                )
+
+        async def flush_summaries():
+            await asyncio.gather(*summary_tasks, return_exceptions=True)
+            summary_tasks.clear()
+
         try:
             if not session_id:
                 session_id = f"session-{int(time.time())}"
@@ -41,6 +98,9 @@ class Agent:
             query = user_input
             step = 0
             reasoning_steps = []
+            perception = None
+            tool_output = ""
+            context = ContextBuilder(query)
             
             self.logger.info(f"Processing query: {user_input}")
             
@@ -50,40 +110,66 @@ class Agent:
                 message=f"Processing query: {user_input}"
             )
             
+            outcome = "max_steps"
             while step < max_steps:
                 self.logger.info(f"Step {step + 1} started")
                 
-                # Extract perception
-                self.logger.info("Generating perception...")
-                perception = extract_perception(user_input)
-                self.logger.info(f"Intent: {perception.intent}, Tool hint: {perception.tool_hint}, Entities: {perception.entities}")
-                await user_interaction.send_update(
-                    session_id=session_id,
-                    stage="perception",
-                    message=f"Intent: {perception.intent}"
-                )
+                timeline = StepTimeline(step + 1)
+
+                async def perceive():
+                    # Extract perception once per query; later steps refine it locally
+                    # from the tool output instead of another LLM round trip
+                    with timeline.stage("perception"):
+                        if perception is not None:
+                            perception_saved["refine"] += 1
+                            result = refine_perception(perception, user_input, tool_output)
+                        elif (result := cached_perception(user_input)) is not None:
+                            perception_saved["cache"] += 1
+                        else:
+                            self.logger.info("Generating perception...")
+                            result = await extract_perception(user_input)
+                    self.logger.info(f"Intent: {result.intent}, Tool hint: {result.tool_hint}, Entities: {result.entities}")
+                    await user_interaction.send_update(
+                        session_id=session_id,
+                        stage="perception",
+                        message=f"Intent: {result.intent}"
+                    )
+                    return result
+
+                async def recall():
+                    # Embedding calls run in a worker thread, so the shared loop keeps
+                    # serving other sessions meanwhile
+                    with timeline.stage("memory"):
+                        result = await asyncio.to_thread(
+                            self.memory.retrieve,
+                            query=user_input,
+                            top_k=3,
+                            session_filter=session_id
+                        )
+                    self.logger.info(f"Retrieved {len(result)} memories")
+                    await user_interaction.send_update(
+                        session_id=session_id,
+                        stage="memory",
+                        message=f"Retrieved {len(result)} relevant data points"
+                    )
+                    return result
+
+                # Neither depends on the other; planning starts once both are in
+                perception, retrieved = await asyncio.gather(perceive(), recall())
+
+                # Rendered catalogs are cached by the server manager, so this is a lookup
+                with timeline.stage("tools"):
+                    tool_descriptions = server_manager.get_tools_description(
+                        tool_hint=perception.tool_hint if TOOL_CATALOG_MODE == "compact" else None
+                    )
+
+                self.logger.info("Retrieved memories Content: %s", retrieved)
                 
                 reasoning_steps.append({
                     "stage": "perception",
                     "action": "extract_intent",
                     "result": perception.intent
                 })
-                
-                # Retrieve memories
-                retrieved = self.memory.retrieve(
-                    query=user_input,
-                    top_k=3,
-                    session_filter=session_id
-                )
-                self.logger.info(f"Retrieved {len(retrieved)} memories")
-                await user_interaction.send_update(
-                    session_id=session_id,
-                    stage="memory",
-                    message=f"Retrieved {len(retrieved)} relevant data points"
-                )
-
-                self.logger.info("Retrieved memories Content: %s", retrieved)
-                
                 reasoning_steps.append({
                     "stage": "memory",
                     "action": "retrieve_context",
@@ -92,11 +178,12 @@ class Agent:
                 
                 # Generate plan using all available tools
                 self.logger.info("Generating plan...")
-                plan = generate_plan(
-                    perception,
-                    retrieved,
-                    tool_descriptions=server_manager.get_tools_description()
-                )
+                with timeline.stage("plan"):
+                    plan = await generate_plan(
+                        perception,
+                        retrieved,
+                        tool_descriptions=tool_descriptions
+                    )
                 self.logger.info(f"Plan generated: {plan}")
                 await user_interaction.send_update(
                     session_id=session_id,
@@ -116,98 +203,127 @@ class Agent:
                     self.logger.info(f"Final result: {final_result}")
                     
                     # Store final result in memory using 'fact' type
-                    self.memory.add(MemoryItem(
-                        text=f"Final answer: {final_result}",
-                        type="final_result",
-                        user_query=query,  # original query
-                        tags=["final_answer"],
-                        session_id=session_id
-                    ))
-                    
-                    # Send iteration summary and final result
-                    await user_interaction.send_update(
-                        session_id=session_id,
-                        stage="reasoning",
-                        message="Completed analysis",
-                        iteration_data={
-                            "stage": "final",
-                            "steps": reasoning_steps,
-                            "result": final_result
-                        },
-                        llm_manager=self.llm
-                    )
+                    with timeline.stage("memory_add"):
+                        dedup_counts[await asyncio.to_thread(self.memory.add, MemoryItem(
+                            text=f"Final answer: {final_result}",
+                            type="final_result",
+                            user_query=query,  # original query
+                            tags=["final_answer"],
+                            session_id=session_id
+                        ))] += 1
                     
-                    await user_interaction.send_update(
-                        session_id=session_id,
-                        stage="agent",
-                        message=final_result,
-                        is_final=True,
-                        raw_data={
-                            "analysis_result": final_result,
-                            "reasoning_steps": reasoning_steps,
-                            "confidence": "high"
-                        },
-                        query_type="analysis",
-                        llm_manager=self.llm
-                    )
+                    # Write the closing iteration summary while the final result streams,
+                    # and send the final event once all summaries are out
+                    summary_tasks.append(asyncio.create_task(summarize({
+                        "stage": "final",
+                        "steps": reasoning_steps,
+                        "result": final_result
+                    })))
+                    with timeline.stage("final_summary"):
+                        final_summary = await user_interaction.compose_final_result(
+                            raw_data={
+                                "analysis_result": final_result,
+                                "reasoning_steps": reasoning_steps,
+                                "confidence": "high"
+                            },
+                            query_type="analysis",
+                            llm_manager=self.llm,
+                            session_id=session_id
+                        )
+                        await flush_summaries()
+                    user_interaction.publish_final_result(session_id, final_summary, "analysis")
+                    outcome = "answered"
+                    answer = {
+                        "final_result": final_result,
+                        "summary": final_summary,
+                        "reasoning_steps": reasoning_steps,
+                        "tool_calls": tool_calls_seen,
+                        "servers": sorted(servers_used)
+                    }
+                    self.logger.info(timeline.summary())
                     break
                 
                 try:
                     self.logger.info("Executing tool...")
                     # Extract tool name and arguments from plan
                     if plan.startswith("FUNCTION_CALL:"):
-                        tool_name, args = parse_function_call(plan)
-
-                        # Get the correct server for this tool
-                        if tool_name not in server_manager.tool_registry:
-                            raise ValueError(f"Unknown tool: {tool_name}")
-                            
-                        tool_info = server_manager.tool_registry[tool_name]
-                        server_name = tool_info['server']
-                        
-                        # Wrap arguments in input field for math tools
-                        if server_name == 'math':  # All math tools need input wrapper
-                            tool_args = {"input": args}
-                        else:
-                            tool_args = args
-                        
-                        # Execute the tool in its correct server context
-                        async def execute_tool_in_context(session):
-                            return await session.call_tool(tool_name, arguments=tool_args)
-                        
-                        result = await server_manager.execute_command(server_name, execute_tool_in_context)
-                        
-                        self.logger.info(f"Tool execution result: {result}")
-                        
-                        # Add the result to reasoning steps
-                        reasoning_steps.append({
-                            "stage": "tool",
-                            "tool_name": tool_name,
-                            "action": tool_args,
-                            "result": str(result)
-                        })
-                        
-                        # Store result in memory
-                        self.memory.add(MemoryItem(
-                            text=f"Tool call: {tool_name} with {tool_args}, got: {result}",
-                            type="tool_output",
-                            tool_name=tool_name,
-                            user_query=user_input,
-                            tags=[tool_name],
-                            session_id=session_id
-                        ))
-                        
-                        # Send iteration summary
-                        await user_interaction.send_iteration_summary(
-                            session_id=session_id,
-                            iteration_data={
+                        calls = []
+                        for tool_name, args in parse_function_calls(plan)[:MAX_PARALLEL_TOOL_CALLS]:
+                            # Get the correct server for this tool
+                            if tool_name not in server_manager.tool_registry:
+                                raise ValueError(f"Unknown tool: {tool_name}")
+                            server_name = server_manager.tool_registry[tool_name]['server']
+
+                            # Wrap arguments in input field for math tools
+                            if server_name == 'math':  # All math tools need input wrapper
+                                calls.append((tool_name, server_name, {"input": args}))
+                            else:
+                                calls.append((tool_name, server_name, args))
+
+                        async def call_tool(tool_name, server_name, tool_args):
+                            # Execute the tool in its correct server context
+                            async def execute_tool_in_context(session):
+                                return await session.call_tool(tool_name, arguments=tool_args)
+
+                            tool_status = "error"
+                            try:
+                                with timeline.stage("tool"), TOOL_CALL_SECONDS.time(tool=tool_name, server=server_name):
+                                    result = await server_manager.execute_command(
+                                        server_name, execute_tool_in_context, session_id=session_id
+                                    )
+                                tool_status = "error" if getattr(result, "isError", False) else "ok"
+                            finally:
+                                TOOL_CALLS_TOTAL.inc(tool=tool_name, server=server_name, status=tool_status)
+                            return result
+
+                        # Independent calls run concurrently; the scheduler spreads them over
+                        # the servers' replicas. Let every call finish before reporting a failure
+                        results = await asyncio.gather(*(call_tool(*call) for call in calls), return_exceptions=True)
+                        for result in results:
+                            if isinstance(result, BaseException):
+                                raise result
+                        if len(calls) > 1:
+                            self.logger.info(f"Ran {len(calls)} tool calls concurrently")
+
+                        # Carry the outputs' text forward, trimmed to the context budget,
+                        # instead of the raw CallToolResult reprs
+                        outputs = context.add_results([
+                            (tool_name, tool_args, result)
+                            for (tool_name, _, tool_args), result in zip(calls, results)
+                        ])
+                        tool_output = "\n\n".join(outputs)
+
+                        for (tool_name, server_name, tool_args), result, output in zip(calls, results, outputs):
+                            self.logger.info(f"Tool execution result: {result}")
+                            tool_calls_seen.append((tool_name, tool_args))
+                            servers_used.add(server_name)
+
+                            # Add the result to reasoning steps
+                            reasoning_steps.append({
+                                "stage": "tool",
+                                "tool_name": tool_name,
+                                "action": tool_args,
+                                "result": output
+                            })
+
+                            # Store result in memory
+                            with timeline.stage("memory_add"):
+                                dedup_counts[await asyncio.to_thread(self.memory.add, MemoryItem(
+                                    text=f"Tool call: {tool_name} with {tool_args}, got: {output}",
+                                    type="tool_output",
+                                    tool_name=tool_name,
+                                    user_query=user_input,
+                                    tags=[tool_name],
+                                    session_id=session_id
+                                ))] += 1
+
+                            # Summarize the call in the background while the next step plans
+                            summary_tasks.append(asyncio.create_task(summarize({
                                 "stage": "tool_execution",
                                 "tool_name": tool_name,
                                 "action": tool_args,
-                                "result": str(result)
-                            },
-                            llm_manager=self.llm
-                        )
+                                "result": output
+                            })))
                         
                         # Send step update
                         #await user_interaction.send_update(
@@ -222,7 +338,11 @@ class Agent:
                         #    }
                         #)
                         
-                        user_input = f"Original task: {query}\nPrevious output: {result}\nWhat should I do next?"
+                        user_input = context.step_input()
+                        self.logger.info(
+                            "Step %d context: %d tokens (tool output %d tokens raw, %d kept)",
+                            step + 1, estimate_tokens(user_input), context.raw_tokens, estimate_tokens(tool_output)
+                        )
                         
                     else:
                         raise ValueError("Plan must start with FUNCTION_CALL:")
@@ -230,6 +350,7 @@ class Agent:
                 except Exception as e:
                     error_msg = f"Tool execution failed: {str(e)}"
                     self.logger.error(error_msg)
+                    await flush_summaries()
                     await user_interaction.send_update(
                         session_id=session_id,
                         stage="error",
@@ -239,13 +360,20 @@ class Agent:
                         query_type="error",
                         llm_manager=self.llm
                     )
+                    outcome = "tool_error"
+                    self.logger.info(timeline.summary())
                     break
                 
+                self.logger.info(timeline.summary())
                 step += 1
                 
+            await flush_summaries()
+
         except Exception as e:
+            outcome = "error"
             error_msg = f"Query processing error: {str(e)}"
             self.logger.error(error_msg)
+            await flush_summaries()
             await user_interaction.send_update(
                 session_id=session_id,
                 stage="error",
@@ -258,8 +386,27 @@ class Agent:
             raise
             
         finally:
+            for task in summary_tasks:  # Only left over when the run was cancelled
+                task.cancel()
+            QUERY_SECONDS.observe(time.perf_counter() - query_started)
+            QUERIES_TOTAL.inc(outcome=outcome)
+            for reason, saved in perception_saved.items():
+                if saved:
+                    LLM_CALLS_SAVED_TOTAL.inc(saved, site="perception", reason=reason)
+            self.logger.info(
+                "Perception LLM calls saved for this query: %d (%d refined locally, %d cached)",
+                sum(perception_saved.values()), perception_saved["refine"], perception_saved["cache"]
+            )
+            self.logger.info(
+                "Memory dedup for this query: %d skipped, %d merged, %d items in index",
+                dedup_counts["skipped"],
+                dedup_counts["merged"],
+                len(self.memory.data)
+            )
             message_broker.close_session(session_id)
 
+        return answer
+
 def extract_tool_name_from_plan(plan: str) -> str:
     """Extract the tool name from the plan string.
     
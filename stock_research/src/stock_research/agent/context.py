@@ -0,0 +1,134 @@
+import json
+import os
+from pydantic import BaseModel
+from typing import List
+
+# Tokens of the latest tool output carried into the next step's input
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Earlier tool calls kept in the scratchpad; older ones are only counted
+CONTEXT_SCRATCHPAD_STEPS = int(os.getenv("CONTEXT_SCRATCHPAD_STEPS", "5"))
+# Tokens of each scratchpad entry's result digest
+SCRATCHPAD_DIGEST_TOKENS = 60
+
+CHARS_PER_TOKEN = 4  # Rough average for Gemini's tokenizer on English text
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count, without a tokenizer round trip"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def result_texts(result) -> List[str]:
+    """Text content items of a CallToolResult, or its repr when it has none"""
+    texts = [content.text for content in getattr(result, "content", None) or [] if getattr(content, "text", None)]
+    return texts or [str(result)]
+
+def trim_to_budget(text: str, max_tokens: int) -> str:
+    """Keep the head of text within max_tokens, cut at a line or word boundary"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max(0, max_tokens * CHARS_PER_TOKEN)
+    head = text[:limit]
+    cut = max(head.rfind("\n"), head.rfind(" "))
+    if cut > limit // 2:
+        head = head[:cut]
+    return f"{head.rstrip()} ... [{estimate_tokens(text) - estimate_tokens(head)} tokens truncated]"
+
+def share_budget(sizes: List[int], max_tokens: int) -> List[int]:
+    """Split max_tokens so small parts keep their full size and large ones share the rest evenly"""
+    budgets = [0] * len(sizes)
+    remaining = max_tokens
+    pending = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    while pending:
+        share = remaining // len(pending)
+        i = pending.pop(0)
+        budgets[i] = min(sizes[i], share)
+        remaining -= budgets[i]
+    return budgets
+
+def trim_items(texts: List[str], max_tokens: int) -> str:
+    """
+    Join content items within max_tokens, sharing the budget so one long item
+    (e.g. a single RAG chunk) cannot crowd out the others. Each item keeps its
+    last line when it fits, which is where RAG chunks cite their source.
+    """
+    budgets = share_budget([estimate_tokens(text) for text in texts], max_tokens)
+    trimmed = []
+    for i, text in enumerate(texts):
+        if estimate_tokens(text) <= budgets[i]:
+            trimmed.append(text)
+            continue
+        body, _, last_line = text.rstrip().rpartition("\n")
+        if body and estimate_tokens(last_line) < budgets[i] // 2:
+            trimmed.append(trim_to_budget(body, budgets[i] - estimate_tokens(last_line)) + "\n" + last_line)
+        else:
+            trimmed.append(trim_to_budget(text, budgets[i]))
+    return "\n\n".join(trimmed)
+
+class ScratchpadEntry(BaseModel):
+    step: int
+    tool_name: str
+    arguments: str
+    digest: str
+
+class ContextBuilder:
+    """
+    Builds each step's input from the original query, a rolling scratchpad of
+    earlier tool calls and the latest step's tool outputs, trimmed to a token
+    budget, instead of appending raw CallToolResult reprs.
+    """
+
+    def __init__(self, query: str, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 scratchpad_steps: int = CONTEXT_SCRATCHPAD_STEPS):
+        self.query = query
+        self.token_budget = token_budget
+        self.scratchpad_steps = scratchpad_steps
+        self.scratchpad: List[ScratchpadEntry] = []  # Earlier calls, as digests
+        self.latest: List[tuple] = []  # (entry, trimmed output) for each call of the latest step
+        self.steps = 0
+        self.raw_tokens = 0  # Tokens of the latest outputs before trimming
+
+    def add_result(self, tool_name: str, arguments, result) -> str:
+        """Record a step's single tool call and return its output text, trimmed to the token budget"""
+        return self.add_results([(tool_name, arguments, result)])[0]
+
+    def add_results(self, calls: List[tuple]) -> List[str]:
+        """
+        Record the (tool_name, arguments, result) calls made in one step and return
+        their output texts. The calls share the token budget.
+        """
+        # The previous step's outputs move from full text to one-line digests
+        for entry, output in self.latest:
+            entry.digest = trim_to_budget(" ".join(output.split()), SCRATCHPAD_DIGEST_TOKENS)
+            self.scratchpad.append(entry)
+        self.steps += 1
+
+        texts = [result_texts(result) for _, _, result in calls]
+        self.raw_tokens = sum(estimate_tokens(str(result)) for _, _, result in calls)
+        budgets = share_budget([sum(estimate_tokens(text) for text in items) for items in texts], self.token_budget)
+        self.latest = [
+            (ScratchpadEntry(
+                step=self.steps,
+                tool_name=tool_name,
+                arguments=json.dumps(arguments, default=str),
+                digest=""
+            ), trim_items(items, budget))
+            for (tool_name, arguments, _), items, budget in zip(calls, texts, budgets)
+        ]
+        return [output for _, output in self.latest]
+
+    def step_input(self) -> str:
+        """Input for the next step's perception and planning"""
+        lines = [f"Original task: {self.query}"]
+        earlier = self.scratchpad
+        if earlier:
+            lines.append("Previous steps:")
+            omitted = len(earlier) - self.scratchpad_steps
+            if omitted > 0:
+                lines.append(f"- ({omitted} earlier calls omitted)")
+                earlier = earlier[omitted:]
+            for entry in earlier:
+                lines.append(f"- Step {entry.step}: {entry.tool_name} {entry.arguments} -> {entry.digest}")
+        for entry, output in self.latest:
+            lines.append(f"Latest output ({entry.tool_name} {entry.arguments}):")
+            lines.append(output)
+        lines.append("What should I do next?")
+        return "\n".join(lines)
@@ -6,6 +6,7 @@ from dotenv import load_dotenv
 import google.generativeai as genai
 import os
 from .config.log_config import setup_logging
+from .llm.router import llm_router
 
 logger = setup_logging(__name__)
 
@@ -25,11 +26,13 @@ api_key = os.getenv('GOOGLE_API_KEY')
 if not api_key:
     raise ValueError("GOOGLE_API_KEY not found in environment variables")
 genai.configure(api_key=api_key)
-model = genai.GenerativeModel("gemini-2.0-flash")            
 logger.info("Gemini API configured successfully")
 
+# Independent tool calls the planner may request in one step
+MAX_PARALLEL_TOOL_CALLS = int(os.getenv("MAX_PARALLEL_TOOL_CALLS", "4"))
 
-def generate_plan(
+
+async def generate_plan(
     perception: PerceptionResult,
     memory_items: List[MemoryItem],
     tool_descriptions: Optional[str] = None
@@ -53,11 +56,13 @@ Always follow this loop:
 1. Think step-by-step about the problem.
 2. If a tool is needed, respond using the format:
    FUNCTION_CALL: tool_name|param1=value1|param2=value2
+   If several calls are needed that do not depend on each other's results, list them
+   one per line (at most {MAX_PARALLEL_TOOL_CALLS}); they run together and you get all results in the next step.
 3. When the final answer is known, respond using:
    FINAL_ANSWER: [your final result]
 
 Guidelines:
-- Respond using EXACTLY ONE of the formats above per step.
+- Respond using EXACTLY ONE of the formats above per step: one or more FUNCTION_CALL lines, or one FINAL_ANSWER.
 - Do NOT include extra text, explanation, or formatting.
 - Use nested keys (e.g., input.string) and square brackets for lists.
 - You can reference these relevant memories:
@@ -75,6 +80,9 @@ Input Summary:
 - FUNCTION_CALL: strings_to_chars_to_int|string=INDIA
 - FUNCTION_CALL: int_list_to_exponential_sum|int_list=[73,78,68,73,65]
 - FINAL_ANSWER: [42]
+- Two independent searches in one step:
+  FUNCTION_CALL: search_documents|query="Narayana Health revenue"
+  FUNCTION_CALL: search_documents|query="Rainbow Hospitals revenue"
 
 ✅ Examples:
 - User asks: "What’s the relationship between Cricket and Sachin Tendulkar"
@@ -99,16 +107,26 @@ IMPORTANT:
     #logger.info("Generate Plan Prompt: %s", prompt)
 
     try:
-        response = model.generate_content(
-            contents=prompt
-        )
-        raw = response.text.strip()
+        # The router records the prompt's token count, as reported by the tier that answered
+        raw = await llm_router.generate("decision", prompt)
+        if raw is None:  # Routed to the local tier, which cannot plan
+            return "FINAL_ANSWER: [unknown]"
+        raw = raw.strip()
         logger.info("Generate Plan LLM output: %s", raw)
 
+        # Keep every call up to a final answer; a final answer after calls waits for their results
+        calls = []
         for line in raw.splitlines():
-            if line.strip().startswith("FUNCTION_CALL:") or line.strip().startswith("FINAL_ANSWER:"):
-                return line.strip()
-
+            line = line.strip()
+            if line.startswith("FINAL_ANSWER:"):
+                if calls:
+                    break
+                return line
+            if line.startswith("FUNCTION_CALL:"):
+                calls.append(line)
+
+        if calls:
+            return "\n".join(calls[:MAX_PARALLEL_TOOL_CALLS])
         return raw.strip()
 
     except Exception as e:
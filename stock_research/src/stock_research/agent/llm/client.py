@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import os
+import time
+import threading
+import weakref
+from typing import AsyncIterator, Optional
+from ...backend.metrics import record_llm_call
+
+# Default seconds before an LLM call is abandoned
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+# LLM requests allowed in flight at once per event loop, across all sessions
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+class AsyncLLMClient:
+    """
+    Single entry point for LLM calls from async code.
+
+    Each call is bounded by a timeout, counts against a shared concurrency limit
+    and is recorded in the LLM metrics. Models exposing generate_content_async are
+    awaited natively, so cancelling the caller cancels the request; others run in a
+    worker thread, which is abandoned (not killed) on timeout or cancellation.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, timeout: float = LLM_TIMEOUT):
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.logger = logging.getLogger(__name__)
+        # asyncio primitives belong to one loop, so keep a semaphore per loop
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+        self._in_flight = 0
+        self._waiting = 0
+        self._timeouts = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def generate(self, model, prompt: str, site: str, timeout: Optional[float] = None):
+        """Run model.generate_content(prompt) without blocking the loop; returns the raw response"""
+        timeout = self.timeout if timeout is None else timeout
+        semaphore = self._semaphore()
+        self._waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._in_flight += 1
+        started = time.perf_counter()
+        try:
+            if hasattr(model, "generate_content_async"):
+                call = model.generate_content_async(contents=prompt)
+            else:
+                call = asyncio.to_thread(model.generate_content, contents=prompt)
+            response = await asyncio.wait_for(call, timeout=timeout)
+        except asyncio.TimeoutError as e:
+            self._timeouts += 1
+            self.logger.error("LLM call at %s timed out after %.1fs", site, timeout)
+            record_llm_call(site, time.perf_counter() - started, error=e)
+            raise
+        except BaseException as e:  # Including cancellation, so abandoned calls are counted
+            record_llm_call(site, time.perf_counter() - started, error=e)
+            raise
+        finally:
+            self._in_flight -= 1
+            semaphore.release()
+
+        record_llm_call(site, time.perf_counter() - started, response)
+        return response
+
+    async def stream(self, model, prompt: str, site: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        Yield the response text chunk by chunk as the model writes it. The timeout
+        bounds the whole response, and the call holds a concurrency slot until the
+        last chunk or until the caller stops iterating.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        semaphore = self._semaphore()
+        self._waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._in_flight += 1
+        started = time.perf_counter()
+        deadline = started + timeout
+        last_chunk = None
+        chunks = self._stream_chunks(model, prompt)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(anext(chunks), timeout=max(0.0, deadline - time.perf_counter()))
+                except StopAsyncIteration:
+                    break
+                last_chunk = chunk
+                text = getattr(chunk, "text", "")
+                if text:
+                    yield text
+        except asyncio.TimeoutError as e:
+            self._timeouts += 1
+            self.logger.error("LLM stream at %s timed out after %.1fs", site, timeout)
+            record_llm_call(site, time.perf_counter() - started, error=e)
+            raise
+        except BaseException as e:  # Including the caller closing the stream early
+            record_llm_call(site, time.perf_counter() - started, error=e)
+            raise
+        finally:
+            await chunks.aclose()
+            self._in_flight -= 1
+            semaphore.release()
+
+        # Streamed responses report token usage on their last chunk
+        record_llm_call(site, time.perf_counter() - started, last_chunk)
+
+    @staticmethod
+    async def _stream_chunks(model, prompt: str):
+        if hasattr(model, "generate_content_async"):
+            response = await model.generate_content_async(contents=prompt, stream=True)
+            async for chunk in response:
+                yield chunk
+            return
+
+        # Synchronous streams are drained by a worker thread and handed over through a queue
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stopped = threading.Event()
+        done = object()
+
+        def pump():
+            try:
+                for chunk in model.generate_content(contents=prompt, stream=True):
+                    if stopped.is_set():
+                        return
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        threading.Thread(target=pump, name="llm-stream", daemon=True).start()
+        try:
+            while (chunk := await queue.get()) is not done:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            stopped.set()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "timeouts": self._timeouts
+        }
+
+# Global client shared by perception, decision and summaries
+llm_client = AsyncLLMClient()
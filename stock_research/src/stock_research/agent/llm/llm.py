@@ -7,15 +7,15 @@ import asyncio
 from concurrent.futures import TimeoutError
 from typing import Tuple, Optional, Dict
 from ..config.log_config import setup_logging
+from .router import llm_router
 
 class LLMManager:
     def __init__(self):
         """Initialize the LLM manager with configuration and API setup"""
         self.logger = logging.getLogger(__name__)
-        self.model = None
         
     def initialize(self):
-        """Initialize the LLM with API key and model configuration"""
+        """Configure the Gemini API; models are picked per call by the router's tiers"""
         self.logger.info("Initializing LLM...")
         try:
             # Load environment variables
@@ -29,23 +29,23 @@ class LLMManager:
             # Configure Gemini
             self.logger.info("Configuring Gemini API...")
             genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel("gemini-1.5-flash")
             self.logger.info("Gemini API configured successfully")
             
         except Exception as e:
             self.logger.error(f"Error initializing LLM: {str(e)}")
             raise
 
-    async def generate_with_timeout(self, prompt: str, timeout: int = 10):
+    async def generate_with_timeout(self, prompt: str, timeout: Optional[float] = None, site: str = "summary"):
         """
         Generate content with a timeout
         
         Args:
             prompt: The prompt to send to the LLM
-            timeout: Maximum time to wait for response in seconds
+            timeout: Maximum time to wait for response in seconds; defaults to the routed tier's
+            site: Call site, which selects the model tier and labels the LLM metrics
             
         Returns:
-            The LLM response
+            The LLM response, or None when the site is routed to the local tier
             
         Raises:
             TimeoutError: If generation takes too long
@@ -53,19 +53,12 @@ class LLMManager:
         """
         self.logger.info("Starting LLM generation...")
         try:
-            # Convert the synchronous generate_content call to run in a thread
-            loop = asyncio.get_event_loop()
+            # Shares the routing, timeouts and concurrency limit of perception and decision calls
             #self.logger.info(f"Prompt: {prompt}")
-            response = await asyncio.wait_for(
-                loop.run_in_executor(
-                    None, 
-                    lambda: self.model.generate_content(
-                        contents=prompt
-                    )
-                ),
-                timeout=timeout
-            )
-            raw = response.text.strip()
+            raw = await llm_router.generate(site, prompt, timeout=timeout)
+            if raw is None:
+                return None
+            raw = raw.strip()
             self.logger.info(f"LLM output: {raw}")
 
             for line in raw.splitlines():
@@ -81,3 +74,27 @@ class LLMManager:
         except Exception as e:
             self.logger.error(f"Error in LLM generation: {e}")
             raise
+
+    async def stream_with_timeout(self, prompt: str, timeout: Optional[float] = None, site: str = "summary"):
+        """
+        Stream generated text chunk by chunk
+        
+        Args:
+            prompt: The prompt to send to the LLM
+            timeout: Maximum time to wait for the whole response in seconds; defaults to the routed tier's
+            site: Call site, which selects the model tier and labels the LLM metrics
+            
+        Yields:
+            Text chunks in the order the model writes them; none on the local tier
+        """
+        self.logger.info("Starting streamed LLM generation...")
+        try:
+            async for text in llm_router.stream(site, prompt, timeout=timeout):
+                yield text
+            self.logger.info("Streamed LLM generation completed")
+        except TimeoutError:
+            self.logger.error("Streamed LLM generation timed out!")
+            raise
+        except Exception as e:
+            self.logger.error(f"Error in streamed LLM generation: {e}")
+            raise
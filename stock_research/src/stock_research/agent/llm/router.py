@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+import google.generativeai as genai
+from .client import llm_client, LLM_TIMEOUT
+from ..context import estimate_tokens
+from ...backend.metrics import (
+    LLM_TIER_CALLS_TOTAL, LLM_TIER_SECONDS, LLM_COST_TOTAL, LLM_CALLS_SAVED_TOTAL, PROMPT_TOKENS
+)
+
+# Tiers from most to least capable; a call falls back along this order
+TIERS = ("premium", "economy", "local")
+
+# Model per tier; "local" answers with rules and templates and never calls a model
+TIER_MODELS = {
+    "premium": os.getenv("LLM_PREMIUM_MODEL", "gemini-2.0-flash"),
+    "economy": os.getenv("LLM_ECONOMY_MODEL", "gemini-1.5-flash"),
+}
+TIER_TIMEOUTS = {
+    "premium": float(os.getenv("LLM_PREMIUM_TIMEOUT", str(LLM_TIMEOUT))),
+    "economy": float(os.getenv("LLM_ECONOMY_TIMEOUT", "10")),
+}
+# USD per million prompt and completion tokens, for the cost counter
+TIER_PRICES = {
+    "premium": (float(os.getenv("LLM_PREMIUM_PRICE_IN", "0.10")), float(os.getenv("LLM_PREMIUM_PRICE_OUT", "0.40"))),
+    "economy": (float(os.getenv("LLM_ECONOMY_PRICE_IN", "0.075")), float(os.getenv("LLM_ECONOMY_PRICE_OUT", "0.30"))),
+}
+
+# "template" keeps summaries on the local tier, as before routing existed
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "llm").lower()
+
+def _parse_routes(spec: str) -> Dict[str, str]:
+    """'site=tier,site=tier' into a dict, ignoring unknown tiers"""
+    routes = {}
+    for part in spec.split(","):
+        site, _, tier = part.partition("=")
+        if tier.strip() in TIERS:
+            routes[site.strip()] = tier.strip()
+    return routes
+
+DEFAULT_ROUTES = {
+    "decision": "premium",
+    "perception": "economy",
+    "summary": "local" if SUMMARY_MODE == "template" else "economy",
+}
+# Tier per call site, e.g. LLM_ROUTES="perception=local,summary=economy"
+LLM_ROUTES = {**DEFAULT_ROUTES, **_parse_routes(os.getenv("LLM_ROUTES", ""))}
+
+class LLMRouter:
+    """
+    Picks a model tier for each LLM call site.
+
+    A call starts at its site's tier and drops to the next cheaper tier when the
+    model times out or fails. The local tier runs the caller's rule-based fallback
+    (or returns None so the caller uses its template) without any LLM call.
+    """
+
+    def __init__(self, routes: Dict[str, str] = LLM_ROUTES):
+        self.routes = routes
+        self.models = {}  # tier -> model, created on first use
+        self.logger = logging.getLogger(__name__)
+
+    def model(self, tier: str):
+        if tier not in self.models:
+            self.models[tier] = genai.GenerativeModel(TIER_MODELS[tier])
+        return self.models[tier]
+
+    def tiers(self, site: str) -> tuple:
+        """Tiers a call from site may use, in fallback order"""
+        return TIERS[TIERS.index(self.routes.get(site, "premium")):]
+
+    async def generate(self, site: str, prompt: str, local: Optional[Callable[[], Any]] = None,
+                       timeout: Optional[float] = None) -> Any:
+        """
+        Response text from the first tier that answers in time. On the local tier this is
+        whatever local() returns (None without one). Raises the last model error when
+        every model tier failed and there is no local fallback.
+        """
+        error = None
+        for tier in self.tiers(site):
+            if tier == "local":
+                return self._local(site, local, error)
+            started = time.perf_counter()
+            try:
+                response = await llm_client.generate(
+                    self.model(tier), prompt, site=site, timeout=timeout or TIER_TIMEOUTS[tier]
+                )
+                text = response.text
+            except Exception as e:
+                self._record(site, tier, started, prompt, error=e)
+                self.logger.warning("%s tier failed for %s (%s), falling back", tier, site, type(e).__name__)
+                error = e
+                continue
+            self._record(site, tier, started, prompt, response=response, text=text)
+            return text
+
+    async def stream(self, site: str, prompt: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        Stream response text from the site's tier. A tier that fails before its first
+        chunk falls back to the next one; on the local tier nothing is yielded, so the
+        caller uses its template.
+        """
+        error = None
+        for tier in self.tiers(site):
+            if tier == "local":
+                self._local(site, lambda: None, error)
+                return
+            started = time.perf_counter()
+            parts = []
+            try:
+                async for text in llm_client.stream(
+                    self.model(tier), prompt, site=site, timeout=timeout or TIER_TIMEOUTS[tier]
+                ):
+                    parts.append(text)
+                    yield text
+            except Exception as e:
+                self._record(site, tier, started, prompt, error=e)
+                if parts:
+                    raise  # Text already reached the client; a different tier cannot continue it
+                self.logger.warning("%s tier failed for %s (%s), falling back", tier, site, type(e).__name__)
+                error = e
+                continue
+            self._record(site, tier, started, prompt, text="".join(parts))
+            return
+
+    def _local(self, site: str, local: Optional[Callable[[], Any]], error: Optional[Exception]):
+        if local is None and error is not None:
+            raise error  # No rule-based answer for this site; let the caller handle the failure
+        LLM_TIER_CALLS_TOTAL.inc(site=site, tier="local", status="ok")
+        LLM_CALLS_SAVED_TOTAL.inc(site=site, reason="fallback" if error is not None else "local")
+        return local() if local else None
+
+    def _record(self, site: str, tier: str, started: float, prompt: str, response=None, text: str = "",
+                error: Optional[Exception] = None):
+        LLM_TIER_SECONDS.observe(time.perf_counter() - started, tier=tier)
+        if error is not None:
+            status = "timeout" if isinstance(error, asyncio.TimeoutError) else "error"
+            LLM_TIER_CALLS_TOTAL.inc(site=site, tier=tier, status=status)
+            return
+        LLM_TIER_CALLS_TOTAL.inc(site=site, tier=tier, status="ok")
+        # Prefer reported usage; streamed and fake responses fall back to estimates
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None) or estimate_tokens(prompt)
+        completion_tokens = getattr(usage, "candidates_token_count", None) or estimate_tokens(text)
+        PROMPT_TOKENS.observe(prompt_tokens, site=site)
+        self.logger.info("%s prompt tokens on the %s tier: %d", site, tier, prompt_tokens)
+        price_in, price_out = TIER_PRICES[tier]
+        LLM_COST_TOTAL.inc((prompt_tokens * price_in + completion_tokens * price_out) / 1e6, tier=tier)
+
+# Global router shared by perception, decision and summaries
+llm_router = LLMRouter()
@@ -3,7 +3,9 @@
 import numpy as np
 import faiss
 import requests
-from typing import List, Optional, Literal
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Literal
 from pydantic import BaseModel
 from datetime import datetime
 from .config.log_config import setup_logging
@@ -21,14 +23,37 @@ class MemoryItem(BaseModel):
 
 
 class MemoryManager:
-    def __init__(self, embedding_model_url="http://localhost:11434/api/embeddings", model_name="nomic-embed-text"):
+    def __init__(
+        self,
+        embedding_model_url="http://localhost:11434/api/embeddings",
+        model_name="nomic-embed-text",
+        dedup_threshold: Optional[float] = None,
+        dedup_window: int = 20,
+        dedup_mode: Literal["skip", "merge"] = "skip"
+    ):
+        """
+        Args:
+            dedup_threshold: Cosine similarity above which a new item is treated as a
+                near-duplicate of a recent item in the same session. None disables dedup.
+            dedup_window: Number of recent items per session to compare against
+            dedup_mode: "skip" drops the new item, "merge" folds its tags and timestamp
+                into the existing item
+        """
         self.embedding_model_url = embedding_model_url
         self.model_name = model_name
         self.index = None
         self.data: List[MemoryItem] = []
         self.embeddings: List[np.ndarray] = []
-
-    def _get_embedding(self, text: str) -> np.ndarray:
+        self.dedup_threshold = dedup_threshold
+        self.dedup_window = dedup_window
+        self.dedup_mode = dedup_mode
+        self._recent_by_session: Dict[Optional[str], Deque[int]] = {}
+        self.stats = {"added": 0, "skipped": 0, "merged": 0}
+        # Sessions add and retrieve from worker threads; keeps the index, data and
+        # recent-item positions in step. Embeddings are fetched outside it
+        self._lock = threading.Lock()
+
+    def get_embedding(self, text: str) -> np.ndarray:
         #logger.info("Getting embedding for text: %s", text)
         response = requests.post(
             self.embedding_model_url,
@@ -38,18 +63,62 @@ class MemoryManager:
         #logger.info("Embedding response: %s", response.json())
         return np.array(response.json()["embedding"], dtype=np.float32)
 
-    def add(self, item: MemoryItem):
+    def _find_near_duplicate(self, item: MemoryItem, emb: np.ndarray) -> Optional[int]:
+        """Return the index of a recent same-session item whose embedding is within the dedup threshold"""
+        recent = self._recent_by_session.get(item.session_id)
+        if not recent:
+            return None
+
+        norm = np.linalg.norm(emb)
+        if norm == 0:
+            return None
+
+        candidates = [idx for idx in recent if self.data[idx].type == item.type]
+        if not candidates:
+            return None
+
+        matrix = np.stack([self.embeddings[idx] for idx in candidates])
+        similarities = matrix @ emb / (np.linalg.norm(matrix, axis=1) * norm + 1e-12)
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.dedup_threshold:
+            logger.info("Near-duplicate memory found (similarity=%.4f)", similarities[best])
+            return candidates[best]
+        return None
+
+    def add(self, item: MemoryItem) -> Literal["added", "skipped", "merged"]:
+        """Add an item to memory. Returns "skipped" or "merged" for a near-duplicate, else "added"."""
         #logger.info("Adding item to memory: %s", item)
-        emb = self._get_embedding(item.text)
+        emb = self.get_embedding(item.text)
         #logger.info("Embedding: %s", emb)
-        self.embeddings.append(emb)
-        self.data.append(item)
 
-        # Initialize or add to index
-        if self.index is None:
-            self.index = faiss.IndexFlatL2(len(emb))
-        self.index.add(np.stack([emb]))
-        logger.info("Item added to memory")
+        with self._lock:
+            if self.dedup_threshold is not None:
+                duplicate_idx = self._find_near_duplicate(item, emb)
+                if duplicate_idx is not None:
+                    if self.dedup_mode == "merge":
+                        existing = self.data[duplicate_idx]
+                        existing.tags = list(dict.fromkeys(existing.tags + item.tags))
+                        existing.timestamp = item.timestamp
+                        self.stats["merged"] += 1
+                        logger.info("Merged near-duplicate item into memory %d", duplicate_idx)
+                        return "merged"
+                    self.stats["skipped"] += 1
+                    logger.info("Skipped near-duplicate item (%d skipped so far)", self.stats["skipped"])
+                    return "skipped"
+
+            self.embeddings.append(emb)
+            self.data.append(item)
+            self._recent_by_session.setdefault(
+                item.session_id, deque(maxlen=self.dedup_window)
+            ).append(len(self.data) - 1)
+
+            # Initialize or add to index
+            if self.index is None:
+                self.index = faiss.IndexFlatL2(len(emb))
+            self.index.add(np.stack([emb]))
+            self.stats["added"] += 1
+            logger.info("Item added to memory")
+            return "added"
 
     def retrieve(
         self,
@@ -64,15 +133,13 @@ class MemoryManager:
         if not self.index or len(self.data) == 0:
             return []
 
-        query_vec = self._get_embedding(query).reshape(1, -1)
-        D, I = self.index.search(query_vec, top_k * 2)  # Overfetch to allow filtering
+        query_vec = self.get_embedding(query).reshape(1, -1)
+        with self._lock:
+            D, I = self.index.search(query_vec, top_k * 2)  # Overfetch to allow filtering
+            items = [self.data[idx] for idx in I[0] if 0 <= idx < len(self.data)]
 
         results = []
-        for idx in I[0]:
-            if idx >= len(self.data):
-                continue
-            item = self.data[idx]
-
+        for item in items:
             # Filter by type
             if type_filter and item.type != type_filter:
                 continue
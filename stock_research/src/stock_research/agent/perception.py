@@ -6,7 +6,9 @@ from dotenv import load_dotenv
 import google.generativeai as genai
 import re
 import json
+from collections import OrderedDict
 from .config.log_config import setup_logging
+from .llm.router import llm_router
 
 # Optional: import log from agent if shared, else define locally
 #try:
@@ -26,9 +28,19 @@ api_key = os.getenv('GOOGLE_API_KEY')
 if not api_key:
     raise ValueError("GOOGLE_API_KEY not found in environment variables")
 genai.configure(api_key=api_key)
-model = genai.GenerativeModel("gemini-2.0-flash")            
 logger.info("Gemini API configured successfully")
 
+# Perceptions kept for repeated inputs, keyed by normalized input text
+PERCEPTION_CACHE_SIZE = int(os.getenv("PERCEPTION_CACHE_SIZE", "256"))
+MAX_ENTITIES = 20
+_perception_cache: "OrderedDict[str, PerceptionResult]" = OrderedDict()
+
+TICKER_PATTERN = re.compile(r"\b[A-Z]{2,5}\b")
+NUMBER_PATTERN = re.compile(r"[-+]?\d[\d,]*(?:\.\d+)?\s?(?:%|percent|crore|lakh|million|billion|bn|mn)?", re.IGNORECASE)
+NAME_PATTERN = re.compile(r"\b[A-Z][a-z]+(?:\s+[A-Z][a-z]+)+\b")
+EMAIL_PATTERN = re.compile(r"\b(e-?mail|mail|send)\b", re.IGNORECASE)
+MATH_PATTERN = re.compile(r"\b(calculate|compute|sum|add|multiply|divide|subtract|power|factorial|sqrt)\b", re.IGNORECASE)
+
 
 class PerceptionResult(BaseModel):
     user_input: str
@@ -37,8 +49,67 @@ class PerceptionResult(BaseModel):
     tool_hint: Optional[str] = None  # Optional field with default
 
 
-def extract_perception(user_input: str) -> PerceptionResult:
+def _normalize(user_input: str) -> str:
+    return " ".join(user_input.lower().split())
+
+def cached_perception(user_input: str) -> Optional[PerceptionResult]:
+    """Perception previously extracted for the same normalized input, if still cached"""
+    key = _normalize(user_input)
+    cached = _perception_cache.get(key)
+    if cached is None:
+        return None
+    _perception_cache.move_to_end(key)
+    return cached.model_copy(update={"user_input": user_input})
+
+def _remember(user_input: str, perception: PerceptionResult):
+    _perception_cache[_normalize(user_input)] = perception
+    while len(_perception_cache) > PERCEPTION_CACHE_SIZE:
+        _perception_cache.popitem(last=False)
+
+def extract_entities(text: str) -> List[str]:
+    """Tickers, figures and proper names found in text, without an LLM call"""
+    entities = []
+    for pattern in (TICKER_PATTERN, NAME_PATTERN, NUMBER_PATTERN):
+        for match in pattern.findall(text):
+            match = match.strip()
+            if match and match not in entities:
+                entities.append(match)
+    return entities
+
+def refine_perception(perception: PerceptionResult, user_input: str, tool_output: str) -> PerceptionResult:
+    """
+    Carry a query's perception into the next step: keep its intent and tool hint,
+    take the new step input, and add entities extracted locally from the tool output.
+    """
+    entities = list(perception.entities)
+    for entity in extract_entities(tool_output):
+        if len(entities) >= MAX_ENTITIES:
+            break
+        if entity not in entities:
+            entities.append(entity)
+    return perception.model_copy(update={"user_input": user_input, "entities": entities})
+
+def rule_based_perception(user_input: str) -> PerceptionResult:
+    """Perception from keyword rules and regex entities, used when no model is routed or answers"""
+    if EMAIL_PATTERN.search(user_input):
+        tool_hint = "send-email"
+    elif MATH_PATTERN.search(user_input):
+        tool_hint = None  # Too many math tools to guess one from keywords
+    else:
+        tool_hint = "search_documents"
+    first_line = user_input.strip().splitlines()[0] if user_input.strip() else ""
+    return PerceptionResult(
+        user_input=user_input,
+        intent=" ".join(first_line.split()[:12]).lower() or "unknown",
+        entities=extract_entities(user_input)[:MAX_ENTITIES],
+        tool_hint=tool_hint
+    )
+
+async def extract_perception(user_input: str) -> PerceptionResult:
     """Extracts intent, entities, and tool hints using LLM"""
+    if (cached := cached_perception(user_input)) is not None:
+        return cached
+
     prompt = f"""
     You are an AI that extracts structured facts from user input.
     Input: "{user_input}"
@@ -50,8 +121,11 @@ def extract_perception(user_input: str) -> PerceptionResult:
     logger.info("user_input: %s", user_input)
     try:
         logger.info("Generating perception...")
-        response = model.generate_content(contents=prompt)
-        raw = response.text.strip()
+        # The local tier answers with rules directly; those results are not cached
+        raw = await llm_router.generate("perception", prompt, local=lambda: rule_based_perception(user_input))
+        if isinstance(raw, PerceptionResult):
+            return raw
+        raw = raw.strip()
         logger.info("LLM output: %s", raw)
 
         # Clean the output
@@ -65,12 +139,14 @@ def extract_perception(user_input: str) -> PerceptionResult:
                 parsed["entities"] = list(parsed["entities"].values())
             
             # Create PerceptionResult with all required fields
-            return PerceptionResult(
+            perception = PerceptionResult(
                 user_input=user_input,
                 intent=parsed.get("intent", "unknown"),  # Provide default value
                 entities=parsed.get("entities", []),     # Provide default value
                 tool_hint=parsed.get("tool_hint")        # Optional field
             )
+            _remember(user_input, perception)  # Fallbacks below are not cached
+            return perception
             
         except json.JSONDecodeError as e:
             logger.error("Failed to parse JSON: %s", e)
@@ -3,9 +3,13 @@ from ...backend.message_broker import message_broker
 from ..llm.llm import LLMManager
 import json
 import asyncio
+import html
+import logging
 from functools import partial
 import google.generativeai as genai
 
+logger = logging.getLogger(__name__)
+
 class UserInteraction:
     # Common HTML template for all updates
     MESSAGE_TEMPLATE = """
@@ -53,49 +57,119 @@ class UserInteraction:
         }
     }
 
+    # Icon keys sent with structured events; HTML sessions get the emoji inline
+    ICONS = {
+        "perception": "📋",
+        "memory": "🔍",
+        "plan": "📝",
+        "tool": "⚙️",
+        "agent": "🤖",
+        "summary": "📊",
+        "result": "🎯",
+        "info": "ℹ️"
+    }
+
     @staticmethod
     async def _generate_llm_response(llm_manager: LLMManager, prompt: str) -> str:
-        """Helper method to generate LLM response with error handling"""
+        """Helper method to generate LLM response; None means the caller uses its template"""
         try:
-            if llm_manager and llm_manager.model:
+            # The router picks the tier; the local tier returns None, so the caller uses its template
+            if llm_manager is not None:
                 return await llm_manager.generate_with_timeout(prompt)
         except Exception as e:
-            return f"Error generating response: {str(e)}"
+            logger.warning("LLM summary failed, using the template: %s", e)
+            return None  # Every model tier failed; a template beats an error in the panel
         return None
 
+    @staticmethod
+    async def _stream_llm_response(session_id: str, llm_manager: LLMManager, prompt: str, query_type: str) -> str:
+        """
+        Like _generate_llm_response, but sends each chunk to the session as a partial event.
+        A stream that fails partway is not kept as the answer: the full response is
+        requested again without streaming, and the final event replaces the partial text.
+        """
+        parts = []
+        data = {"title": f"{query_type.title()} Results", "query_type": query_type}
+        try:
+            if llm_manager is not None:
+                async for text in llm_manager.stream_with_timeout(prompt):
+                    parts.append(text)
+                    message_broker.send_event(session_id, "final", "result", text, "partial", data=data)
+        except Exception as e:
+            if not parts:
+                logger.warning("Streamed summary failed, using the template: %s", e)
+                return None
+            logger.warning("Streamed summary failed after %d chunks, regenerating it: %s", len(parts), e)
+            return await UserInteraction._generate_llm_response(llm_manager, prompt)
+        return "".join(parts).strip() or None
+
     @staticmethod
     def send_step_update(session_id: str, stage: str, message: str) -> None:
         """Simple step update with consistent formatting"""
         if not session_id:
             return
 
-        icons = {
-            "perception": "📋",
-            "memory": "🔍",
-            "plan": "📝",
-            "tool": "⚙️",
-            "agent": "🤖"
-        }
-        
-        icon = icons.get(stage, "ℹ️")
-        
+        icon = stage if stage in UserInteraction.ICONS else "info"
+        message_broker.send_event(
+            session_id, stage, icon, message,
+            render=lambda: UserInteraction._render_step(icon, message)
+        )
+
+    @staticmethod
+    def _render_step(icon: str, message: str) -> str:
+        """HTML panel for a single step update"""
         content = f"""
         <div style="display: flex; align-items: center; gap: 8px;">
-            <span style="font-size: 16px;">{icon}</span>
+            <span style="font-size: 16px;">{UserInteraction.ICONS[icon]}</span>
             <span style="flex: 1;">{message}</span>
         </div>
         """
-        
-        html = UserInteraction.MESSAGE_TEMPLATE.format(
+        return UserInteraction.MESSAGE_TEMPLATE.format(
             content=content,
             **UserInteraction.STYLES["step"]
         )
-        
-        message_broker.send_update(session_id, html)
+
+    @staticmethod
+    def _render_summary(icon: str, title: str, summary: str, style: str) -> str:
+        """HTML panel for iteration and final summaries"""
+        content = f"""
+            <div style="display: flex; flex-direction: column; gap: 12px;">
+                <div style="display: flex; align-items: center; gap: 8px;">
+                    <span style="font-size: 18px;">{UserInteraction.ICONS[icon]}</span>
+                    <h3 style="margin: 0; font-size: 18px; color: black;">{title}</h3>
+                </div>
+                <div style="line-height: 1.6; color: black;">{summary}</div>
+            </div>
+            """
+        return UserInteraction.MESSAGE_TEMPLATE.format(
+            content=content,
+            **UserInteraction.STYLES[style]
+        )
+
+    @staticmethod
+    def _template_iteration_summary(iteration_data: Dict) -> str:
+        """Iteration summary formatted without an LLM"""
+        if iteration_data.get('stage') == 'final':
+            steps = iteration_data.get('steps') or []
+            tools = [step['tool_name'] for step in steps if step.get('tool_name')]
+            return f"""
+                <p>Completed the analysis in {len(tools)} tool call{'s' if len(tools) != 1 else ''}.</p>
+                <ul style="margin: 15px 0; padding-left: 20px;">
+                    <li style="margin-bottom: 8px;">Tools used: {html.escape(', '.join(dict.fromkeys(tools)) or 'none')}</li>
+                    <li style="margin-bottom: 8px;">Result: {html.escape(str(iteration_data.get('result', 'No result available')))}</li>
+                </ul>
+                """
+        return f"""
+                <p>Step: {html.escape(str(iteration_data.get('stage', 'unknown')))}</p>
+                <ul style="margin: 15px 0; padding-left: 20px;">
+                    <li style="margin-bottom: 8px;">Action: Used {html.escape(str(iteration_data.get('tool_name', 'tool')))} with {html.escape(str(iteration_data.get('action', 'no arguments')))}</li>
+                    <li style="margin-bottom: 8px;">Result: {html.escape(str(iteration_data.get('result', 'No result available')))}</li>
+                </ul>
+                """
 
     @staticmethod
     async def send_iteration_summary(session_id: str, iteration_data: Dict, llm_manager: LLMManager) -> None:
-        """Generate a user-friendly iteration summary using LLM"""
+        """Generate a user-friendly iteration summary, using the LLM unless summaries are routed to the local tier"""
         if not session_id or not iteration_data:
             return
 
@@ -122,39 +196,36 @@ class UserInteraction:
         try:
             summary = await UserInteraction._generate_llm_response(llm_manager, prompt)
             if not summary:
-                summary = f"""
-                <p>Step: {iteration_data.get('stage', 'unknown')}</p>
-                <ul style="margin: 15px 0; padding-left: 20px;">
-                    <li style="margin-bottom: 8px;">Action: Used {iteration_data.get('tool_name', 'tool')} to {iteration_data.get('action', 'analyze data')}</li>
-                    <li style="margin-bottom: 8px;">Result: {iteration_data.get('result', 'No result available')}</li>
-                </ul>
-                """
+                summary = UserInteraction._template_iteration_summary(iteration_data)
 
-            content = f"""
-            <div style="display: flex; flex-direction: column; gap: 12px;">
-                <div style="display: flex; align-items: center; gap: 8px;">
-                    <span style="font-size: 18px;">📊</span>
-                    <h3 style="margin: 0; font-size: 18px; color: black;">Analysis Step Summary</h3>
-                </div>
-                <div style="line-height: 1.6; color: black;">{summary}</div>
-            </div>
-            """
-
-            html = UserInteraction.MESSAGE_TEMPLATE.format(
-                content=content,
-                **UserInteraction.STYLES["iteration"]
+            title = "Analysis Step Summary"
+            message_broker.send_event(
+                session_id, "iteration", "summary", summary, data={"title": title},
+                render=lambda: UserInteraction._render_summary("summary", title, summary, "iteration")
             )
-            
-            message_broker.send_update(session_id, html)
         except Exception as e:
             message_broker.send_update(session_id, f"Error creating summary: {str(e)}")
 
     @staticmethod
     async def send_final_result(session_id: str, raw_data: Dict, query_type: str, llm_manager: LLMManager) -> None:
-        """Generate a well-formatted, user-friendly final result using LLM"""
+        """Generate a well-formatted, user-friendly final result and send it"""
         if not session_id or not raw_data:
             return
 
+        try:
+            summary = await UserInteraction.compose_final_result(raw_data, query_type, llm_manager, session_id)
+            UserInteraction.publish_final_result(session_id, summary, query_type)
+        except Exception as e:
+            message_broker.send_update(session_id, f"Error creating final summary: {str(e)}", "error")
+
+    @staticmethod
+    async def compose_final_result(raw_data: Dict, query_type: str, llm_manager: LLMManager,
+                                   session_id: Optional[str] = None) -> str:
+        """
+        Final result body, written by the LLM unless summaries are routed to the local tier. With a
+        session_id, the text is also streamed to that session as "partial" events while
+        it is written; the final event sent afterwards carries the complete result.
+        """
         prompt = f"""
         Create a clear, user-friendly summary of the {query_type} results.
         Focus on the key findings and insights that would be most valuable to the user.
@@ -175,29 +246,23 @@ class UserInteraction:
         10.Inlclude a header which says "Final Results"
         """
 
-        try:
+        if session_id:
+            summary = await UserInteraction._stream_llm_response(session_id, llm_manager, prompt, query_type)
+        else:
             summary = await UserInteraction._generate_llm_response(llm_manager, prompt)
-            if not summary:
-                summary = str(raw_data.get('result', 'No results available'))
+        if not summary:
+            result = raw_data.get('analysis_result', raw_data.get('result', raw_data.get('error', 'No results available')))
+            summary = f"<p>{html.escape(str(result))}</p>"
+        return summary
 
-            content = f"""
-            <div style="display: flex; flex-direction: column; gap: 12px;">
-                <div style="display: flex; align-items: center; gap: 8px;">
-                    <span style="font-size: 18px;">🎯</span>
-                    <h3 style="margin: 0; font-size: 18px; color: black;">{query_type.title()} Results</h3>
-                </div>
-                <div style="line-height: 1.6; color: black;">{summary}</div>
-            </div>
-            """
-
-            html = UserInteraction.MESSAGE_TEMPLATE.format(
-                content=content,
-                **UserInteraction.STYLES["final"]
-            )
-            
-            message_broker.send_update(session_id, html, "final")
-        except Exception as e:
-            message_broker.send_update(session_id, f"Error creating final summary: {str(e)}", "error")
+    @staticmethod
+    def publish_final_result(session_id: str, summary: str, query_type: str) -> None:
+        """Send a composed final result as the session's final event"""
+        title = f"{query_type.title()} Results"
+        message_broker.send_event(
+            session_id, "final", "result", summary, "final", data={"title": title, "query_type": query_type},
+            render=lambda: UserInteraction._render_summary("result", title, summary, "final")
+        )
 
     @staticmethod
     async def send_update(session_id: str, stage: str, message: str, is_final: bool = False, 
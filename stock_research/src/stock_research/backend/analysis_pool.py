@@ -0,0 +1,118 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict
+from .message_broker import message_broker
+
+class AnalysisPool:
+    """
+    Bounded pool of concurrent agent runs with a bounded wait queue.
+
+    try_admit() is called from request handlers (any thread) and rejects work once
+    both the workers and the queue are full. run() executes on the shared loop: it
+    waits for a free worker in FIFO order, keeps queued sessions informed of their
+    position, and records queue-wait and run time for every request.
+    """
+
+    def __init__(self, max_workers: int = 8, max_queued: int = 32, history: int = 500):
+        self.max_workers = max(1, max_workers)
+        self.max_queued = max(0, max_queued)
+        self._lock = threading.Lock()
+        self._admitted = 0  # Running plus waiting
+        self._running = 0
+        self._waiters: "OrderedDict[str, asyncio.Future]" = OrderedDict()
+        self._rejected = 0
+        self._completed = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self.request_metrics: deque = deque(maxlen=history)
+
+    def try_admit(self) -> bool:
+        """Reserve a place for a new analysis; False if the pool and its queue are full"""
+        with self._lock:
+            if self._admitted >= self.max_workers + self.max_queued:
+                self._rejected += 1
+                return False
+            self._admitted += 1
+            return True
+
+    def retry_after(self) -> int:
+        """Rough seconds until a slot frees up, used as the retry hint for rejected requests"""
+        avg_run = self._total_run / self._completed if self._completed else 30.0
+        return max(1, math.ceil(avg_run * (len(self._waiters) + 1) / self.max_workers))
+
+    async def run(self, session_id: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Run an admitted analysis once a worker is free"""
+        queued_at = time.monotonic()
+        try:
+            if self._running >= self.max_workers or self._waiters:
+                slot = asyncio.get_running_loop().create_future()
+                self._waiters[session_id] = slot
+                self._send_positions()
+                try:
+                    await slot  # Resolved when a finishing run hands over its worker
+                except asyncio.CancelledError:
+                    if slot.done() and not slot.cancelled():
+                        self._release()
+                    else:
+                        self._waiters.pop(session_id, None)
+                        self._send_positions()
+                    raise
+            else:
+                self._running += 1
+
+            started_at = time.monotonic()
+            try:
+                return await factory()
+            finally:
+                self._release()
+                self._record(session_id, started_at - queued_at, time.monotonic() - started_at)
+        finally:
+            with self._lock:
+                self._admitted -= 1
+
+    def _release(self):
+        """Hand the worker to the next waiter, or free it"""
+        while self._waiters:
+            _, slot = self._waiters.popitem(last=False)
+            if not slot.done():
+                slot.set_result(None)
+                self._send_positions()
+                return
+        self._running -= 1
+
+    def _send_positions(self):
+        total = len(self._waiters)
+        for position, session_id in enumerate(self._waiters, start=1):
+            message_broker.send_event(
+                session_id, "queue", "info",
+                f"Queued: position {position} of {total}, waiting for a free analysis slot...",
+                data={"queue_position": position, "queue_length": total}
+            )
+
+    def _record(self, session_id: str, queue_wait: float, run_time: float):
+        self._completed += 1
+        self._total_wait += queue_wait
+        self._total_run += run_time
+        self.request_metrics.append({
+            "session_id": session_id,
+            "queue_wait": queue_wait,
+            "run_time": run_time,
+            "finished_at": time.time()
+        })
+        print(f"Analysis {session_id} waited {queue_wait:.2f}s, ran {run_time:.2f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool occupancy plus average queue wait and run time"""
+        return {
+            "max_workers": self.max_workers,
+            "max_queued": self.max_queued,
+            "running": self._running,
+            "queued": len(self._waiters),
+            "rejected": self._rejected,
+            "completed": self._completed,
+            "avg_queue_wait": self._total_wait / self._completed if self._completed else 0.0,
+            "avg_run_time": self._total_run / self._completed if self._completed else 0.0
+        }
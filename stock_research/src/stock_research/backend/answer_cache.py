@@ -0,0 +1,177 @@
+"""
+Persistent cache of the agent's final answers.
+
+Entries are keyed on the normalized query and the RAG index version, and stored
+in SQLite so they survive restarts and are shared between backend processes.
+Only answers built from RAG and math tools are stored: their outputs only change
+with the index, so the index version stands in for the tool outputs. A query
+that sends an email must run again. Lookups match the normalized query exactly
+first, then paraphrases by embedding similarity that name the same tickers,
+companies and figures.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+import numpy as np
+from .query_dedup import normalize_query, rag_index_version, CACHEABLE_SERVERS
+from .metrics import ANSWER_CACHE_LOOKUPS_TOTAL
+from ..agent.perception import extract_entities
+
+# Seconds an answer stays valid (default 6 hours, as figures go stale); 0 disables the cache
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(6 * 3600)))
+# Cosine similarity above which a paraphrased query reuses an answer
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    query_key TEXT NOT NULL,
+    rag_version TEXT NOT NULL,
+    entities TEXT NOT NULL,
+    query TEXT NOT NULL,
+    embedding BLOB,
+    final_result TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    reasoning_steps TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (query_key, rag_version)
+);
+CREATE INDEX IF NOT EXISTS answers_rag_version ON answers (rag_version, created_at);
+"""
+
+def query_entities(query: str) -> str:
+    """Tickers, names and figures a query asks about, compared case-insensitively"""
+    return json.dumps(sorted({entity.lower() for entity in extract_entities(query)}))
+
+class AnswerCache:
+    def __init__(self, path: str, embed: Callable[[str], np.ndarray], ttl: float = ANSWER_CACHE_TTL,
+                 similarity: float = ANSWER_CACHE_SIMILARITY):
+        self.path = path
+        self.embed = embed
+        self.ttl = ttl
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(answers)")}
+        if columns and "entities" not in columns:  # Cache written by an older version; start over
+            self._conn.execute("DROP TABLE answers")
+        self._conn.executescript(SCHEMA)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _execute(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        try:
+            emb = np.asarray(self.embed(text), dtype=np.float32)
+        except Exception as e:  # No embedding service: exact matches still work
+            print(f"Answer cache embedding failed: {e}")
+            return None
+        norm = np.linalg.norm(emb)
+        return emb / norm if norm else None
+
+    def lookup(self, query: str) -> Optional[dict]:
+        """
+        The newest valid answer for this query or a close paraphrase, or None. A paraphrase
+        must name the same entities: "Analyze TSLA today" never reuses "Analyze AAPL today".
+        """
+        if not self.enabled:
+            return None
+        version = json.dumps(rag_index_version())
+        oldest = time.time() - self.ttl
+        columns = "query, final_result, summary, reasoning_steps, created_at"
+
+        rows = self._execute(
+            f"SELECT {columns} FROM answers WHERE query_key = ? AND rag_version = ? AND created_at > ? "
+            "ORDER BY created_at DESC LIMIT 1",
+            (normalize_query(query), version, oldest)
+        )
+        if rows:
+            ANSWER_CACHE_LOOKUPS_TOTAL.inc(result="exact")
+            return self._entry(rows[0], "exact")
+
+        candidates = self._execute(
+            f"SELECT {columns}, embedding FROM answers WHERE rag_version = ? AND entities = ? AND created_at > ? "
+            "AND embedding IS NOT NULL ORDER BY created_at DESC",
+            (version, query_entities(query), oldest)
+        )
+        emb = self._embed(query) if candidates else None
+        if emb is not None:
+            # Entries embedded by a different model cannot be compared
+            candidates = [row for row in candidates if len(row[-1]) == emb.nbytes]
+        if emb is not None and candidates:
+            matrix = np.stack([np.frombuffer(row[-1], dtype=np.float32) for row in candidates])
+            scores = matrix @ emb
+            best = int(np.argmax(scores))  # Rows are newest first, so ties go to the newest
+            if scores[best] >= self.similarity:
+                ANSWER_CACHE_LOOKUPS_TOTAL.inc(result="semantic")
+                return self._entry(candidates[best][:-1], "semantic", float(scores[best]))
+
+        ANSWER_CACHE_LOOKUPS_TOTAL.inc(result="miss")
+        return None
+
+    @staticmethod
+    def _entry(row: tuple, match: str, score: float = 1.0) -> dict:
+        query, final_result, summary, reasoning_steps, created_at = row
+        return {
+            "query": query,
+            "final_result": final_result,
+            "summary": summary,
+            "reasoning_steps": json.loads(reasoning_steps),
+            "created_at": created_at,
+            "match": match,
+            "score": score
+        }
+
+    def store(self, query: str, answer: dict) -> bool:
+        """
+        Store an agent answer ({final_result, summary, reasoning_steps, tool_calls, servers}).
+        Returns False when the answer was not cached: it used a tool with side effects,
+        it was not grounded in any tool output, or the agent gave up with an unknown answer.
+        """
+        if not self.enabled:
+            return False
+        if not answer.get("tool_calls"):
+            return False
+        if any(server not in CACHEABLE_SERVERS for server in answer.get("servers", [])):
+            return False
+        if answer["final_result"].strip("[] ").lower() == "unknown":
+            return False
+
+        query_key = normalize_query(query)
+        version = json.dumps(rag_index_version())
+        emb = self._embed(query)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Answers built on an older index, or past their TTL, are superseded
+                self._conn.execute(
+                    "DELETE FROM answers WHERE rag_version != ? OR created_at <= ?", (version, now - self.ttl)
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO answers (query_key, rag_version, entities, query, embedding, "
+                    "final_result, summary, reasoning_steps, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (query_key, version, query_entities(query), query, emb.tobytes() if emb is not None else None,
+                     answer["final_result"], answer["summary"],
+                     json.dumps(answer.get("reasoning_steps", []), default=str), now)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return True
+
+def create_answer_cache(embed: Callable[[str], np.ndarray]) -> AnswerCache:
+    """Answer cache at ANSWER_CACHE_DB (default: stock_research_answers.db in the temp directory)"""
+    default_path = Path(tempfile.gettempdir()) / "stock_research_answers.db"
+    return AnswerCache(os.getenv("ANSWER_CACHE_DB", str(default_path)), embed)
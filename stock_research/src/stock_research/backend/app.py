@@ -9,7 +9,11 @@ from rich.table import Table
 from rich.box import ROUNDED
 from .message_broker import message_broker
 from .server_manager import mcp_server
-from .stock_agent_handler import start_stock_analysis
+from .stock_agent_handler import start_stock_analysis, analysis_pool, single_flight, CORE_SERVERS
+from .metrics import metrics
+from ..agent.userinteraction.userinteraction import UserInteraction
+from functools import lru_cache
+import threading
 
 app = Flask(__name__)
 CORS(app)
@@ -22,77 +26,40 @@ def extract_stock_symbol(query: str) -> str:
 
 # Initialize services at startup instead of before_first_request
 def initialize_services():
-    """Initialize services"""
+    """Start the MCP servers without blocking; readiness is tracked per server"""
     try:
-        # Start MCP server
+        # Start MCP server; replicas come up in the background on the shared loop
         mcp_server.start()
-        
-        # Wait for initialization with increased timeout
-        if not mcp_server.wait_for_initialization(timeout=120):
-            app.logger.error("Failed to initialize MCP server: Timeout after 120 seconds")
-            return
-        
-        # Log available tools
-        tools_desc = mcp_server.get_tools_description()
-        
-        app.logger.info("MCP Server initialized successfully")
-        app.logger.info(f"Available tools:\n{tools_desc}")
+        threading.Thread(target=log_when_ready, daemon=True, name="mcp_init_logger").start()
         
     except Exception as e:
         app.logger.error(f"Failed to initialize services: {str(e)}")
 
-# Initialize services when the module is imported
+def log_when_ready():
+    """Log available tools once every server is up, or which ones are still missing"""
+    if not mcp_server.wait_for_initialization(timeout=120):
+        pending = [name for name, state in mcp_server.get_server_status().items() if state != 'ready']
+        app.logger.error(f"MCP servers still initializing after 120 seconds: {', '.join(pending)}")
+        return
+    
+    # Log available tools
+    tools_desc = mcp_server.get_tools_description()
+    
+    app.logger.info("MCP Server initialized successfully")
+    app.logger.info(f"Available tools:\n{tools_desc}")
+
+# Start services when the module is imported; this returns immediately
 initialize_services()
 
 def create_html_panel(title, content, border_style="step"):
     """Create an HTML panel with the same style as send_step_update"""
-    # Style configurations matching UserInteraction.STYLES
-    STYLES = {
-        "step": {
-            "padding": "8px 12px",
-            "bg_color": "#ffffff",
-            "margin": "8px",
-            "border_color": "rgba(37, 99, 235, 0.15)",  # Light blue
-            "text_color": "black"
-        },
-        "iteration": {
-            "padding": "12px 16px",
-            "bg_color": "#ffffff",
-            "margin": "12px",
-            "border_color": "rgba(5, 150, 105, 0.15)",  # Light green
-            "text_color": "black"
-        },
-        "final": {
-            "padding": "16px 20px",
-            "bg_color": "#ffffff",
-            "margin": "16px",
-            "border_color": "rgba(109, 40, 217, 0.15)",  # Light purple
-            "text_color": "black"
-        }
-    }
-    
-    style = STYLES.get(border_style, STYLES["step"])
-    
-    return f"""
-    <div class="message-container" style="
-        font-family: system-ui, -apple-system, sans-serif;
-        padding: {style['padding']};
-        background-color: {style['bg_color']};
-        border-radius: 8px;
-        margin-bottom: {style['margin']};
-        border: 1px solid {style['border_color']};
-        color: {style['text_color']};
-        box-shadow: 0 1px 2px rgba(0, 0, 0, 0.02);
-    ">
-        <div style="
-            border-left: 2px solid {style['border_color']};
-            padding-left: 10px;
-        ">
+    return UserInteraction.MESSAGE_TEMPLATE.format(
+        content=f"""
             <div style="font-weight: bold; margin-bottom: 8px;">{title}</div>
             <div>{content}</div>
-        </div>
-    </div>
-    """
+        """,
+        **UserInteraction.STYLES.get(border_style, UserInteraction.STYLES["step"])
+    )
 
 def create_html_table(title, headers, rows, style="magenta"):
     """Create an HTML table with the same style as userinteraction.py"""
@@ -127,9 +94,9 @@ def create_html_table(title, headers, rows, style="magenta"):
     """
     return table_html
 
-@app.route('/status')
-def status():
-    """Get server status and available tools with formatted HTML response"""
+@lru_cache(maxsize=1)
+def welcome_html() -> str:
+    """Welcome panel for clients that want server-rendered HTML; static, so built once"""
     # Create single panel with welcome message and capabilities
     content = f"""
     <div style="display: flex; flex-direction: column; gap: 12px;">
@@ -187,22 +154,77 @@ def status():
         </div>
     </div>
     """
-    
-    return jsonify({
-        "status": "ready" if mcp_server.initialized else "initializing",
-        "html": full_html
-    })
+    return full_html
 
-@app.route('/query')
-def query():
-    query_text = request.args.get('message', '')
+def status_payload(render_html: bool = True) -> dict:
+    """Server status and welcome panel shared by the Flask and ASGI /status endpoints"""
+    servers = mcp_server.get_server_status()
     
-    # Create a new processing session
-    session = message_broker.create_session()
+    # Queries can start once the core servers are up; others (e.g. Gmail) are awaited per query
+    payload = {
+        "status": "ready" if all(servers[name] == 'ready' for name in CORE_SERVERS) else "initializing",
+        "servers": servers
+    }
+    if render_html:
+        payload["html"] = welcome_html()
+    return payload
+
+def wants_html(output_format) -> bool:
+    """Clients pass format=structured to render events themselves"""
+    return output_format != 'structured'
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def stats_samples(stats: dict, prefix: tuple = ()) -> list:
+    """Numeric entries of a stats() dict as gauge samples labelled by stat name"""
+    return [
+        (prefix + (name,), value)
+        for name, value in stats.items()
+        if isinstance(value, (int, float))
+    ]
+
+# Queue depths and occupancy, read from each component when /metrics is scraped
+metrics.gauge("message_broker_state", "Message broker sessions, subscribers and queued messages",
+              ("stat",), lambda: stats_samples(message_broker.stats()))
+metrics.gauge("analysis_pool_state", "Analysis pool occupancy and queue", ("stat",),
+              lambda: stats_samples(analysis_pool.stats()))
+metrics.gauge("query_dedup_state", "Shared in-flight runs and cached answers", ("stat",),
+              lambda: stats_samples(single_flight.stats()))
+metrics.gauge("mcp_replica_state", "MCP replica health, outstanding calls and scheduler queue",
+              ("server", "replica", "stat"),
+              lambda: [
+                  sample
+                  for server, replicas in mcp_server.get_server_stats().items()
+                  for replica, stats in replicas.items()
+                  for sample in stats_samples(stats, (server, replica))
+              ])
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for agent stages, tools, MCP servers, LLM calls and queues"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/status')
+def status():
+    """Get server status and available tools with formatted HTML response"""
+    return jsonify(status_payload(wants_html(request.args.get('format'))))
+
+def begin_query(query_text: str, loop=None, render_html: bool = True) -> tuple:
+    """
+    Start a query's analysis, or follow an identical one already running or recently
+    answered; shared by both server modes. Returns (session_id, queue) to stream.
+    """
+    key = single_flight.key(query_text, render_html)
+    with single_flight.lock:
+        if (joined := single_flight.join(key, loop)) is not None:
+            return joined
+        # Create a new processing session
+        session = message_broker.create_session(loop=loop, render_html=render_html)
+        single_flight.lead(key, session.session_id)
     
     # Send initial status
-    message_broker.send_update(
-        session.session_id,
+    message_broker.send_event(
+        session.session_id, "agent", "agent",
         f"Processing query: {query_text}"
     )
     
@@ -210,31 +232,87 @@ def query():
     symbol = extract_stock_symbol(query_text)
     if symbol:
         enhanced_query = f"{query_text}"
-        # Start the agent-based analysis
-        start_stock_analysis(session.session_id, enhanced_query)
+        # Start the agent-based analysis, unless the analysis pool is saturated
+        if not start_stock_analysis(session.session_id, enhanced_query):
+            single_flight.abandon(session.session_id)
+            retry_after = analysis_pool.retry_after()
+            message_broker.send_event(
+                session.session_id, "queue", "info",
+                f"The server is busy with other analyses. Please try again in about {retry_after} seconds.",
+                "final",
+                data={"rejected": True, "retry_after": retry_after}
+            )
+            message_broker.close_session(session.session_id)
     else:
-        message_broker.send_update(
-            session.session_id,
+        message_broker.send_event(
+            session.session_id, "agent", "info",
             "I couldn't find a stock symbol in your query. Please provide a valid stock symbol (e.g., AAPL, MSFT).",
             "final"
         )
+        single_flight.abandon(session.session_id)
         message_broker.close_session(session.session_id)
 
-    def generate():
-        """Generate SSE events from the message queue"""
+    return session.session_id, session.message_queue
+
+def parse_last_event_id(value) -> tuple:
+    """Split an SSE event id of the form "<session_id>:<event id>" into its parts"""
+    session_id, _, event_id = (value or '').rpartition(':')
+    try:
+        return session_id or None, int(event_id)
+    except ValueError:
+        return None, 0
+
+def format_sse(session_id: str, message: dict) -> str:
+    """Format a broker message as an SSE event; the id lets clients resume after it"""
+    return f"id: {session_id}:{message['id']}\ndata: {json.dumps(message)}\n\n"
+
+def resume_session(last_event_id_header, loop=None):
+    """Reattach a reconnecting client to its session; None if there is nothing to resume"""
+    session_id, last_event_id = parse_last_event_id(last_event_id_header)
+    if session_id is None:
+        return None, None
+    return session_id, message_broker.subscribe(session_id, last_event_id, loop=loop)
+
+def stream_events(session_id: str, queue):
+    """Generate SSE events from a session queue until the session completes"""
+    try:
         while True:
-            message = session.message_queue.get()  # Blocks until message is available
-            
+            message = queue.get()  # Blocks until message is available
+
             if message is None:  # Session is complete
                 break
-                
-            yield f"data: {json.dumps(message)}\n\n"
-            
+
+            yield format_sse(session_id, message)
+
             if message['type'] == 'final':
                 break
+    finally:
+        message_broker.unsubscribe(session_id, queue)
+
+@app.route('/query')
+def query():
+    # A reconnecting EventSource sends Last-Event-ID; replay instead of rerunning the analysis
+    session_id, queue = resume_session(request.headers.get('Last-Event-ID'))
+    if queue is None:
+        session_id, queue = begin_query(request.args.get('message', ''), render_html=wants_html(request.args.get('format')))
+
+    return Response(
+        stream_with_context(stream_events(session_id, queue)),
+        mimetype='text/event-stream'
+    )
+
+@app.route('/session/<session_id>/events')
+def session_events(session_id):
+    """Attach to an existing session, replaying the messages after Last-Event-ID"""
+    _, last_event_id = parse_last_event_id(
+        request.headers.get('Last-Event-ID') or f":{request.args.get('last_event_id', 0)}"
+    )
+    queue = message_broker.subscribe(session_id, last_event_id)
+    if queue is None:
+        return jsonify({"error": "Unknown or expired session"}), 404
 
     return Response(
-        stream_with_context(generate()),
+        stream_with_context(stream_events(session_id, queue)),
         mimetype='text/event-stream'
     )
 
@@ -0,0 +1,86 @@
+"""
+ASGI variant of the backend.
+
+Serves the same /status and /query contracts as the Flask app, but each SSE
+stream is an async generator awaiting an asyncio queue instead of a worker
+thread blocked on Queue.get(). The server runs on the shared MCP loop, so agent
+runs, tool calls and SSE streams are all tasks on one event loop.
+"""
+import asyncio
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from .app import (
+    status_payload, begin_query, resume_session, parse_last_event_id, format_sse, wants_html,
+    METRICS_CONTENT_TYPE
+)
+from .metrics import metrics
+from .message_broker import message_broker
+from .server_manager import mcp_server
+
+async def metrics_endpoint(request):
+    """Prometheus metrics for agent stages, tools, MCP servers, LLM calls and queues"""
+    return Response(metrics.render(), headers={'Content-Type': METRICS_CONTENT_TYPE})
+
+async def status(request):
+    """Get server status and available tools with formatted HTML response"""
+    return JSONResponse(status_payload(wants_html(request.query_params.get('format'))))
+
+async def stream_events(session_id: str, queue):
+    """Generate SSE events from a session queue without blocking a thread"""
+    try:
+        while True:
+            message = await queue.get_async()
+
+            if message is None:  # Session is complete
+                break
+
+            yield format_sse(session_id, message)
+
+            if message['type'] == 'final':
+                break
+    finally:
+        message_broker.unsubscribe(session_id, queue)
+
+async def query(request):
+    loop = asyncio.get_running_loop()
+    # A reconnecting EventSource sends Last-Event-ID; replay instead of rerunning the analysis
+    session_id, queue = resume_session(request.headers.get('Last-Event-ID'), loop=loop)
+    if queue is None:
+        # Off the loop: starting a query may look up the answer cache
+        session_id, queue = await asyncio.to_thread(
+            begin_query, request.query_params.get('message', ''), loop=loop,
+            render_html=wants_html(request.query_params.get('format'))
+        )
+
+    return StreamingResponse(stream_events(session_id, queue), media_type='text/event-stream')
+
+async def session_events(request):
+    """Attach to an existing session, replaying the messages after Last-Event-ID"""
+    session_id = request.path_params['session_id']
+    _, last_event_id = parse_last_event_id(
+        request.headers.get('Last-Event-ID') or f":{request.query_params.get('last_event_id', 0)}"
+    )
+    queue = message_broker.subscribe(session_id, last_event_id, loop=asyncio.get_running_loop())
+    if queue is None:
+        return JSONResponse({"error": "Unknown or expired session"}, status_code=404)
+
+    return StreamingResponse(stream_events(session_id, queue), media_type='text/event-stream')
+
+app = Starlette(
+    routes=[
+        Route('/status', status),
+        Route('/metrics', metrics_endpoint),
+        Route('/query', query),
+        Route('/session/{session_id}/events', session_events)
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'])]
+)
+
+def run(host: str = '127.0.0.1', port: int = 5000):
+    """Serve the ASGI app on the shared MCP loop and block until it stops"""
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port))
+    mcp_server.submit(server.serve()).result()
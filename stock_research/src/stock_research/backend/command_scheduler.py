@@ -0,0 +1,91 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+class FairCommandScheduler:
+    """
+    Runs commands for one MCP server with a bounded number in flight.
+
+    Waiting commands are queued per caller session and dispatched round-robin,
+    so one session issuing many calls cannot starve the others. All methods must
+    be called from the event loop that owns the server's ClientSession.
+    """
+
+    def __init__(self, name: str, max_in_flight: int = 4):
+        self.name = name
+        self.max_in_flight = max(1, max_in_flight)
+        self._queues: "OrderedDict[Optional[str], deque]" = OrderedDict()
+        self._in_flight = 0
+        self._started = 0
+        self._completed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._max_queue_depth = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def run(self, session_key: Optional[str], factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Queue a command for the given caller session and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(session_key, deque()).append((factory, future, time.monotonic()))
+        self._max_queue_depth = max(self._max_queue_depth, self.queue_depth)
+        self._dispatch()
+        return await future
+
+    def _dispatch(self):
+        """Start queued commands, one session at a time, until the in-flight limit is reached"""
+        while self._in_flight < self.max_in_flight and self._queues:
+            session_key, queue = next(iter(self._queues.items()))
+            factory, future, enqueued_at = queue.popleft()
+            if queue:
+                self._queues.move_to_end(session_key)
+            else:
+                del self._queues[session_key]
+
+            if future.done():  # Caller gave up while waiting
+                continue
+
+            wait = time.monotonic() - enqueued_at
+            self._started += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+
+            self._in_flight += 1
+            task = asyncio.ensure_future(factory())
+            task.add_done_callback(lambda t, f=future: self._on_done(t, f))
+            future.add_done_callback(lambda f, t=task: t.cancel() if f.cancelled() else None)
+
+    def _on_done(self, task: asyncio.Task, future: asyncio.Future):
+        self._in_flight -= 1
+        self._completed += 1
+        if future.done():
+            if not task.cancelled():
+                task.exception()  # Mark as retrieved; the caller is gone
+        else:
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of queue depth, in-flight count and wait-time metrics"""
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self._in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self._max_queue_depth,
+            "waiting_sessions": len(self._queues),
+            "completed": self._completed,
+            "avg_wait_ms": (self._total_wait / self._started * 1000) if self._started else 0.0,
+            "max_wait_ms": self._max_wait * 1000
+        }
@@ -1,71 +1,406 @@
-from queue import Queue
-from typing import Optional, Any
-from dataclasses import dataclass
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Optional, Any, Callable
+from dataclasses import dataclass, field
 from datetime import datetime
+from pathlib import Path
+import os
+import tempfile
 import threading
+import heapq
+import time
 import uuid
 import json
+import asyncio
+
+# Messages held per session before intermediate updates start being dropped
+MAX_QUEUED_MESSAGES = 100
+# Seconds a session may go without a consumer before it is expired
+SESSION_IDLE_TTL = 600
+# Seconds a closed session is kept for a late consumer to drain
+SESSION_CLOSED_TTL = 60
+# Most recent messages kept per session for reconnecting consumers to replay
+REPLAY_BUFFER_SIZE = 200
+
+class SessionQueue:
+    """
+    Bounded message queue for one SSE consumer, usable from threads or an event loop.
+
+    When full, the oldest intermediate "update" message is dropped to make room;
+    "final", "error" and the closing sentinel are never dropped. Consecutive
+    "partial" chunks of a streamed answer are merged into one message, so a long
+    stream holds one slot instead of one per chunk.
+    """
+    DROPPABLE_TYPES = ("update",)
+
+    def __init__(self, maxsize: int = MAX_QUEUED_MESSAGES, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.maxsize = maxsize
+        self.loop = loop
+        self.dropped = 0
+        self.bytes = 0
+        self.waiting = 0  # Consumers currently blocked in get()
+        self.last_activity = time.monotonic()
+        self._items: deque = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._async_ready = asyncio.Event() if loop else None
+
+    @staticmethod
+    def _size(item: Optional[dict]) -> int:
+        if item is None:
+            return 0
+        return len(str(item.get("content") or "")) + len(str(item.get("data") or ""))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @staticmethod
+    def _merge_partials(earlier: dict, later: dict) -> dict:
+        """One partial message carrying both chunks, under the later one's id"""
+        merged = dict(later)
+        for key in ("content", "text"):  # HTML and structured sessions carry the chunk in different fields
+            if key in later:
+                merged[key] = (earlier.get(key) or "") + (later[key] or "")
+        return merged
+
+    def put(self, item: Optional[dict]):
+        with self._lock:
+            if item is not None and item["type"] == "partial" and self._items \
+                    and self._items[-1] is not None and self._items[-1]["type"] == "partial":
+                self.bytes -= self._size(self._items[-1])
+                item = self._merge_partials(self._items.pop(), item)
+            elif item is not None and item["type"] in self.DROPPABLE_TYPES and len(self._items) >= self.maxsize:
+                oldest = next((i for i, queued in enumerate(self._items)
+                               if queued is not None and queued["type"] in self.DROPPABLE_TYPES), None)
+                self.dropped += 1
+                if oldest is None:
+                    return  # Only undroppable messages queued; drop the new update instead
+                self.bytes -= self._size(self._items[oldest])
+                del self._items[oldest]
+            self._items.append(item)
+            self.bytes += self._size(item)
+            self._not_empty.notify()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._async_ready.set)
+
+    def _pop(self) -> Optional[dict]:
+        item = self._items.popleft()
+        self.bytes -= self._size(item)
+        self.last_activity = time.monotonic()
+        return item
+
+    def get(self) -> Optional[dict]:
+        """Block the calling thread until a message is available"""
+        with self._not_empty:
+            self.waiting += 1
+            try:
+                while not self._items:
+                    self._not_empty.wait()
+                return self._pop()
+            finally:
+                self.waiting -= 1
+
+    async def get_async(self) -> Optional[dict]:
+        """Wait on the queue's event loop until a message is available"""
+        while True:
+            with self._lock:
+                if self._items:
+                    return self._pop()
+                self._async_ready.clear()
+                self.waiting += 1
+            try:
+                await self._async_ready.wait()
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
 
 @dataclass
 class ProcessingSession:
     session_id: str
-    message_queue: Queue
+    message_queue: SessionQueue  # Or any reader with the same get()/get_async() interface
     created_at: datetime
     is_active: bool = True
+    # Set for sessions consumed by an async SSE stream; consumers wait on this loop
+    loop: Optional[asyncio.AbstractEventLoop] = None
+    closed_at: Optional[float] = field(default=None)
+    # Id of the last message published; ids start at 1 and increase by one per message
+    last_event_id: int = 0
+    replay: deque = field(default_factory=lambda: deque(maxlen=REPLAY_BUFFER_SIZE))
+    # Partial chunks of an answer still streaming, kept apart so they cannot push
+    # step updates out of the replay buffer; cleared once the final event is sent
+    partials: deque = field(default_factory=lambda: deque(maxlen=REPLAY_BUFFER_SIZE))
+    # Every attached consumer's queue, message_queue included
+    subscribers: list = field(default_factory=list)
+    # False when the client renders structured events itself (see send_event)
+    render_html: bool = True
+
+class BaseMessageBroker(ABC):
+    """
+    Interface shared by broker backends. Producers call send_update/close_session;
+    SSE consumers read session.message_queue with get() or get_async().
+    """
+
+    @abstractmethod
+    def create_session(self, loop: Optional[asyncio.AbstractEventLoop] = None,
+                       render_html: bool = True) -> ProcessingSession:
+        """
+        Create a new processing session; pass the consumer's loop for async SSE streams.
+        render_html=False opts the session into compact structured events.
+        """
+
+    @abstractmethod
+    def get_session(self, session_id: str) -> Optional[ProcessingSession]:
+        """Get an existing session by ID"""
+
+    @abstractmethod
+    def subscribe(self, session_id: str, last_event_id: int = 0,
+                  loop: Optional[asyncio.AbstractEventLoop] = None):
+        """
+        Attach another consumer to a session. The returned queue first yields the
+        buffered messages with an id after last_event_id, then live ones. None if
+        the session does not exist.
+        """
+
+    @abstractmethod
+    def unsubscribe(self, session_id: str, queue):
+        """Detach a consumer queue once its stream has ended"""
+
+    @abstractmethod
+    def _publish(self, session_id: str, message: dict):
+        """Assign the message its event id and deliver it to a session's consumers"""
+
+    @abstractmethod
+    def buffered_messages(self, session_id: str) -> list:
+        """The session's replay buffer in event id order, read without waiting for new messages"""
+
+    def publish(self, session_id: str, message: dict):
+        """Deliver a previously sent message (e.g. a cached answer) under a new event id"""
+        self._publish(session_id, {k: v for k, v in message.items() if k != "id"})
+
+    @abstractmethod
+    def close_session(self, session_id: str):
+        """Mark a session as complete and send final message"""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        """Session counts and queued message volume, for monitoring"""
+
+    def renders_html(self, session_id: str) -> bool:
+        """Whether the session's client expects server-rendered HTML content"""
+        session = self.get_session(session_id)
+        return session is None or session.render_html
 
-class MessageBroker:
-    def __init__(self):
+    def send_update(self, session_id: str, message: str, message_type: str = "update", data: Any = None):
+        """Send an update message to a specific session"""
+        # Try to parse data as JSON if it's a string
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except:
+                pass
+
+        self._publish(session_id, {
+            "type": message_type,
+            "content": message,
+            "data": data,
+            "timestamp": datetime.now().isoformat()
+        })
+
+    def send_event(self, session_id: str, stage: str, icon: str, text: str, message_type: str = "update",
+                   data: Any = None, render: Optional[Callable[[], str]] = None):
+        """
+        Send a UI event. Structured sessions get {stage, icon, text, data} and render
+        it client-side; HTML sessions get the legacy message whose content is render()
+        (or the plain text), so the HTML is only built when a client needs it.
+        """
+        if self.renders_html(session_id):
+            self.send_update(session_id, render() if render else text, message_type, data)
+            return
+
+        self._publish(session_id, {
+            "type": message_type,
+            "stage": stage,
+            "icon": icon,
+            "text": text,
+            "data": data,
+            "timestamp": datetime.now().isoformat()
+        })
+
+class MessageBroker(BaseMessageBroker):
+    """In-process broker: sessions live in this process's memory"""
+
+    def __init__(self, idle_ttl: float = SESSION_IDLE_TTL, closed_ttl: float = SESSION_CLOSED_TTL,
+                 max_queued_messages: int = MAX_QUEUED_MESSAGES):
+        self.idle_ttl = idle_ttl
+        self.closed_ttl = closed_ttl
+        self.max_queued_messages = max_queued_messages
         self._sessions: dict[str, ProcessingSession] = {}
+        self._publish_lock = threading.Lock()
+        # One (deadline, session_id) entry per session; popped lazily and rescheduled
+        # if the session saw activity since, so expiry never scans every session
+        self._expiry_heap: list[tuple[float, str]] = []
+        self._expiry_lock = threading.Lock()
+        self._expiry_wakeup = threading.Event()
+        self._expired = 0
         self._cleanup_thread = threading.Thread(target=self._cleanup_old_sessions, daemon=True)
         self._cleanup_thread.start()
-    
-    def create_session(self) -> ProcessingSession:
-        """Create a new processing session"""
+
+    def create_session(self, loop: Optional[asyncio.AbstractEventLoop] = None,
+                       render_html: bool = True) -> ProcessingSession:
         session_id = str(uuid.uuid4())
         session = ProcessingSession(
             session_id=session_id,
-            message_queue=Queue(),
-            created_at=datetime.now()
+            message_queue=SessionQueue(self.max_queued_messages, loop),
+            created_at=datetime.now(),
+            loop=loop,
+            render_html=render_html
         )
+        session.subscribers.append(session.message_queue)
         self._sessions[session_id] = session
+        self._schedule_expiry(session_id, time.monotonic() + self.idle_ttl)
         return session
-    
+
     def get_session(self, session_id: str) -> Optional[ProcessingSession]:
-        """Get an existing session by ID"""
         return self._sessions.get(session_id)
-    
-    def send_update(self, session_id: str, message: str, message_type: str = "update", data: Any = None):
-        """Send an update message to a specific session"""
+
+    def subscribe(self, session_id: str, last_event_id: int = 0,
+                  loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional[SessionQueue]:
+        session = self.get_session(session_id)
+        if session is None:
+            return None
+        queue = SessionQueue(self.max_queued_messages, loop)
+        with self._publish_lock:  # No message may land between the replay and going live
+            for message in self._buffered(session):
+                if message["id"] > last_event_id:
+                    queue.put(message)
+            if session.is_active:
+                session.subscribers.append(queue)
+            else:
+                queue.put(None)
+        return queue
+
+    def unsubscribe(self, session_id: str, queue: SessionQueue):
         if session := self.get_session(session_id):
-            # Try to parse data as JSON if it's a string
-            if isinstance(data, str):
-                try:
-                    data = json.loads(data)
-                except:
-                    pass
-                    
-            session.message_queue.put({
-                "type": message_type,
-                "content": message,
-                "data": data,
-                "timestamp": datetime.now().isoformat()
-            })
-    
+            with self._publish_lock:
+                if queue in session.subscribers:
+                    session.subscribers.remove(queue)
+
+    def _publish(self, session_id: str, message: dict):
+        if session := self.get_session(session_id):
+            with self._publish_lock:
+                session.last_event_id += 1
+                message["id"] = session.last_event_id
+                if message["type"] == "partial":
+                    session.partials.append(message)
+                else:
+                    session.replay.append(message)
+                    if message["type"] == "final":
+                        session.partials.clear()  # The final event holds the complete text
+                for queue in session.subscribers:
+                    queue.put(message)
+
+    @staticmethod
+    def _buffered(session: ProcessingSession) -> list:
+        if not session.partials:
+            return list(session.replay)
+        return sorted([*session.replay, *session.partials], key=lambda message: message["id"])
+
+    def buffered_messages(self, session_id: str) -> list:
+        if session := self.get_session(session_id):
+            with self._publish_lock:
+                return self._buffered(session)
+        return []
+
     def close_session(self, session_id: str):
-        """Mark a session as complete and send final message"""
         if session := self.get_session(session_id):
-            session.is_active = False
-            session.message_queue.put(None)  # Sentinel value
-    
+            with self._publish_lock:
+                if session.is_active:
+                    session.is_active = False
+                    session.closed_at = time.monotonic()
+                for queue in session.subscribers:
+                    queue.put(None)  # Sentinel value
+
+    def _schedule_expiry(self, session_id: str, deadline: float):
+        with self._expiry_lock:
+            heapq.heappush(self._expiry_heap, (deadline, session_id))
+            is_earliest = self._expiry_heap[0][1] == session_id
+        if is_earliest:
+            self._expiry_wakeup.set()
+
+    def _next_deadline(self, session: ProcessingSession, now: float) -> Optional[float]:
+        """When the session should expire, or None if that time has passed"""
+        queues = session.subscribers or [session.message_queue]
+        if any(queue.waiting for queue in queues):
+            return now + self.idle_ttl  # A consumer is attached and waiting
+        last_activity = max(queue.last_activity for queue in queues)
+        deadline = last_activity + self.idle_ttl
+        if session.closed_at is not None:
+            deadline = min(deadline, max(session.closed_at, last_activity) + self.closed_ttl)
+        return deadline if deadline > now else None
+
+    def _expire_due_sessions(self) -> Optional[float]:
+        """Expire sessions whose deadline passed; returns seconds until the next deadline"""
+        now = time.monotonic()
+        with self._expiry_lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                _, session_id = heapq.heappop(self._expiry_heap)
+                session = self._sessions.get(session_id)
+                if session is None:
+                    continue
+                deadline = self._next_deadline(session, now)
+                if deadline is not None:
+                    heapq.heappush(self._expiry_heap, (deadline, session_id))
+                    continue
+                # Abandoned or drained: drop the session and whatever it still holds
+                session.is_active = False
+                for queue in session.subscribers:
+                    queue.clear()
+                session.subscribers.clear()
+                session.replay.clear()
+                session.partials.clear()
+                del self._sessions[session_id]
+                self._expired += 1
+            return self._expiry_heap[0][0] - now if self._expiry_heap else None
+
     def _cleanup_old_sessions(self):
-        """Periodically clean up old sessions"""
-        import time
+        """Expire idle and closed sessions as their deadlines come due"""
         while True:
-            current_time = datetime.now()
-            for session_id, session in list(self._sessions.items()):
-                if not session.is_active and (current_time - session.created_at).seconds > 3600:
-                    del self._sessions[session_id]
-            time.sleep(300)  # Clean up every 5 minutes
+            wait = self._expire_due_sessions()
+            self._expiry_wakeup.wait(timeout=wait if wait is not None else self.idle_ttl)
+            self._expiry_wakeup.clear()
+
+    def stats(self) -> dict:
+        sessions = list(self._sessions.values())
+        return {
+            "sessions": len(sessions),
+            "active_sessions": sum(1 for s in sessions if s.is_active),
+            "subscribers": sum(len(s.subscribers) for s in sessions),
+            "queued_messages": sum(len(q) for s in sessions for q in s.subscribers),
+            "queued_bytes": sum(q.bytes for s in sessions for q in s.subscribers),
+            "replay_messages": sum(len(s.replay) + len(s.partials) for s in sessions),
+            "dropped_updates": sum(q.dropped for s in sessions for q in s.subscribers),
+            "expired_sessions": self._expired
+        }
+
+def create_message_broker() -> BaseMessageBroker:
+    """
+    Build the broker selected by MESSAGE_BROKER_BACKEND: "memory" (default) for a
+    single process, or "sqlite" to share sessions between worker processes through
+    the database file at MESSAGE_BROKER_DB.
+    """
+    backend = os.getenv("MESSAGE_BROKER_BACKEND", "memory")
+    if backend == "sqlite":
+        from .sqlite_broker import SQLiteMessageBroker
+        default_path = Path(tempfile.gettempdir()) / "stock_research_broker.db"
+        return SQLiteMessageBroker(os.getenv("MESSAGE_BROKER_DB", str(default_path)))
+    if backend != "memory":
+        raise ValueError(f"Unknown MESSAGE_BROKER_BACKEND: {backend}")
+    return MessageBroker()
 
 # Global message broker instance
-message_broker = MessageBroker()
\ No newline at end of file
+message_broker = create_message_broker()
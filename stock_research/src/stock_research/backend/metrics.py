@@ -0,0 +1,178 @@
+"""
+In-process metrics rendered in the Prometheus text exposition format.
+
+Recording is a dict lookup and an addition under a per-metric lock, so it is
+cheap enough to leave on for every query. Gauges are callbacks evaluated only
+when /metrics is scraped.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict[tuple, list] = {}  # key -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the block, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class Gauge:
+    """Gauge whose samples come from a callback returning (label values, value) pairs"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple,
+                 callback: Callable[[], Iterable[tuple]]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.callback = callback
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, value in self.callback():
+            if value is not None:
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {float(value)}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple,
+              callback: Callable[[], Iterable[tuple]]) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.collect())
+            except Exception as e:  # A failing gauge must not break the whole scrape
+                lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+# Global metrics registry
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "agent_stage_seconds", "Time spent in each agent stage", ("stage",))
+QUERY_SECONDS = metrics.histogram(
+    "agent_query_seconds", "End-to-end agent run time per query")
+QUERIES_TOTAL = metrics.counter(
+    "agent_queries_total", "Agent runs by outcome", ("outcome",))
+TOOL_CALL_SECONDS = metrics.histogram(
+    "agent_tool_call_seconds", "Tool call latency as seen by the agent", ("tool", "server"))
+TOOL_CALLS_TOTAL = metrics.counter(
+    "agent_tool_calls_total", "Tool calls by tool, server and status", ("tool", "server", "status"))
+MCP_COMMAND_SECONDS = metrics.histogram(
+    "mcp_command_seconds", "MCP command latency including scheduler queueing", ("server",))
+MCP_COMMANDS_TOTAL = metrics.counter(
+    "mcp_commands_total", "MCP commands by server and status", ("server", "status"))
+LLM_CALL_SECONDS = metrics.histogram(
+    "llm_call_seconds", "LLM call latency per call site", ("site",))
+LLM_CALLS_TOTAL = metrics.counter(
+    "llm_calls_total", "LLM calls per call site and status", ("site", "status"))
+LLM_TOKENS_TOTAL = metrics.counter(
+    "llm_tokens_total", "LLM tokens per call site, prompt or completion", ("site", "kind"))
+PROMPT_TOKENS = metrics.histogram(
+    "agent_prompt_tokens", "Prompt tokens per agent step and call site", ("site",),
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000))
+LLM_TIER_CALLS_TOTAL = metrics.counter(
+    "llm_tier_calls_total", "Routed LLM calls per call site, model tier and status", ("site", "tier", "status"))
+LLM_TIER_SECONDS = metrics.histogram(
+    "llm_tier_seconds", "Routed LLM call latency per model tier", ("tier",))
+LLM_COST_TOTAL = metrics.counter(
+    "llm_cost_usd_total", "Estimated LLM spend in USD per model tier", ("tier",))
+ANSWER_CACHE_LOOKUPS_TOTAL = metrics.counter(
+    "answer_cache_lookups_total", "Answer cache lookups by result: exact, semantic or miss", ("result",))
+LLM_CALLS_SAVED_TOTAL = metrics.counter(
+    "llm_calls_saved_total", "LLM calls avoided per call site and reason", ("site", "reason"))
+
+def record_llm_call(site: str, seconds: float, response=None, error: Optional[BaseException] = None):
+    """Count an LLM call, its latency and, when the response reports usage, its tokens"""
+    LLM_CALL_SECONDS.observe(seconds, site=site)
+    LLM_CALLS_TOTAL.inc(site=site, status="error" if error is not None else "ok")
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        LLM_TOKENS_TOTAL.inc(getattr(usage, "prompt_token_count", 0) or 0, site=site, kind="prompt")
+        LLM_TOKENS_TOTAL.inc(getattr(usage, "candidates_token_count", 0) or 0, site=site, kind="completion")
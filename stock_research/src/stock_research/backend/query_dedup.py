@@ -0,0 +1,129 @@
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+from .message_broker import message_broker
+
+RAG_INDEX_DIR = Path(__file__).parent.parent / "agent" / "mcp_server" / "rag" / "faiss_index"
+# Servers whose tools only read data, so their answers can be replayed
+CACHEABLE_SERVERS = ("rag", "math")
+
+def normalize_query(query: str) -> str:
+    """Case-, punctuation- and whitespace-insensitive form of a query"""
+    return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+def rag_index_version() -> tuple:
+    """Changes whenever the RAG server rewrites its FAISS index or metadata"""
+    version = []
+    for name in ("index.bin", "metadata.json"):
+        try:
+            stat = os.stat(RAG_INDEX_DIR / name)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+class SingleFlight:
+    """
+    Shares one agent run between identical queries.
+
+    A query whose normalized text matches an analysis still in flight attaches to
+    that session as another SSE subscriber and replays it from the start. When
+    result_ttl > 0, completed answers are also kept for that many seconds and
+    streamed to repeat queries, until the RAG index changes. Only answers built
+    from CACHEABLE_SERVERS are kept: a query that sends an email must run again.
+    """
+
+    def __init__(self, result_ttl: float = 0):
+        self.result_ttl = result_ttl
+        # Held by the caller across lookup and lead() so two identical queries cannot both lead
+        self.lock = threading.Lock()
+        self._in_flight: dict[tuple, str] = {}  # key -> leading session_id
+        self._keys: dict[str, tuple] = {}  # leading session_id -> key
+        self._results: dict[tuple, tuple] = {}  # key -> (completed_at, rag version, messages)
+        self._led = 0
+        self._attached = 0
+        self._cache_hits = 0
+
+    @staticmethod
+    def key(query: str, render_html: bool) -> tuple:
+        # Sessions stream either HTML or structured events, so formats never share a run
+        return normalize_query(query), render_html
+
+    def join(self, key: tuple, loop=None) -> Optional[tuple]:
+        """(session_id, queue) of a run or cached result to follow, or None to start a new run"""
+        if session_id := self._in_flight.get(key):
+            queue = message_broker.subscribe(session_id, loop=loop)
+            if queue is not None:
+                self._attached += 1
+                return session_id, queue
+            self._forget(session_id)  # The session expired without completing
+
+        if cached := self._results.get(key):
+            completed_at, version, messages = cached
+            if time.monotonic() - completed_at < self.result_ttl and version == rag_index_version():
+                self._cache_hits += 1
+                return self._replay(messages, key[1], loop)
+            del self._results[key]
+        return None
+
+    def lead(self, key: tuple, session_id: str):
+        """Register a new run that identical queries should attach to"""
+        self._in_flight[key] = session_id
+        self._keys[session_id] = key
+        self._led += 1
+
+    def abandon(self, session_id: str):
+        """Unregister a run that never started (e.g. rejected by the analysis pool)"""
+        with self.lock:
+            self._forget(session_id)
+
+    def complete(self, session_id: str, servers: Optional[list] = None):
+        """
+        Unregister a finished run and cache its answer; call after the session is closed.
+        servers are those whose tools the answer used; None (no answer) is never cached.
+        """
+        with self.lock:
+            key = self._forget(session_id)
+        if key is None or self.result_ttl <= 0:
+            return
+        if servers is None or any(server not in CACHEABLE_SERVERS for server in servers):
+            return
+
+        # The session is closed, so its replay buffer already holds every message
+        messages = [message for message in message_broker.buffered_messages(session_id)
+                    if message["type"] != "partial"]  # The final event already holds the streamed text
+
+        final = messages[-1] if messages else None
+        if final is None or final["type"] != "final" or (final.get("data") or {}).get("query_type") == "error":
+            return  # Only cache answers, not errors or interrupted runs
+        now = time.monotonic()
+        with self.lock:
+            for stale in [k for k, (completed_at, _, _) in self._results.items() if now - completed_at >= self.result_ttl]:
+                del self._results[stale]
+            self._results[key] = (now, rag_index_version(), messages)
+
+    def _forget(self, session_id: str) -> Optional[tuple]:
+        key = self._keys.pop(session_id, None)
+        if key is not None and self._in_flight.get(key) == session_id:
+            del self._in_flight[key]
+        return key
+
+    def _replay(self, messages: list, render_html: bool, loop=None) -> tuple:
+        """Stream a cached answer through a fresh, already-closed session"""
+        session = message_broker.create_session(loop=loop, render_html=render_html)
+        for message in messages:
+            message_broker.publish(session.session_id, message)
+        message_broker.close_session(session.session_id)
+        return session.session_id, session.message_queue
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._in_flight),
+            "led": self._led,
+            "attached": self._attached,
+            "cache_hits": self._cache_hits,
+            "cached_results": len(self._results)
+        }
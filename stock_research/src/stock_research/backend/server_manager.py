@@ -5,14 +5,36 @@ from typing import Optional, Dict, Any
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 import os
-from queue import Queue
+import re
+import sys
+import time
 from concurrent.futures import Future
 from pathlib import Path
 from ..agent.userinteraction import userinteraction
 from .message_broker import message_broker
+from .command_scheduler import FairCommandScheduler
+from .metrics import MCP_COMMAND_SECONDS, MCP_COMMANDS_TOTAL
 from ..agent import agent
 import traceback
 
+# Seconds between list_tools() health checks on each live session
+HEALTH_CHECK_INTERVAL = float(os.getenv("MCP_HEALTH_CHECK_INTERVAL", "30"))
+# Per-command timeout; long enough for slow document searches
+COMMAND_TIMEOUT = 120.0
+# Default number of concurrent tool calls per server session
+MAX_IN_FLIGHT = int(os.getenv("MCP_MAX_IN_FLIGHT", "4"))
+
+# "python" execs the backend's own (already resolved) interpreter; "uv" resolves the env per launch
+MCP_LAUNCHER = os.getenv("MCP_LAUNCHER", "python")
+
+def _replica_count(server_name: str, default: int = 1) -> int:
+    """Number of server processes to run for a server type, e.g. MCP_RAG_REPLICAS=3"""
+    return max(1, int(os.getenv(f"MCP_{server_name.upper()}_REPLICAS", str(default))))
+
+def _spare_count(server_name: str, default: int = 0) -> int:
+    """Pre-initialized standby processes kept per server type, e.g. MCP_RAG_SPARES=1"""
+    return max(0, int(os.getenv(f"MCP_{server_name.upper()}_SPARES", str(default))))
+
 class MCPServerManager:
     _instance = None
     
@@ -32,7 +54,10 @@ class MCPServerManager:
                     'tools': None,
                     'script_path': str(current_dir / "agent" / "mcp_server" / "math" / "mcp_math_server.py"),
                     'log_file': 'mcp_math_server.log',
-                    'args': []
+                    'args': [],
+                    'max_in_flight': MAX_IN_FLIGHT,
+                    'replicas': _replica_count('math'),
+                    'spares': _spare_count('math')
                 },
                 'rag': {
                     'initialized': False,
@@ -40,7 +65,10 @@ class MCPServerManager:
                     'tools': None,
                     'script_path': str(current_dir / "agent" / "mcp_server" / "rag" / "mcp_rag_server.py"),
                     'log_file': 'mcp_rag_server.log',
-                    'args': []
+                    'args': [],
+                    'max_in_flight': MAX_IN_FLIGHT,
+                    'replicas': _replica_count('rag'),
+                    'spares': _spare_count('rag')
                 },
                 'gmail': {
                     'initialized': False,
@@ -49,131 +77,251 @@ class MCPServerManager:
                     'script_path': str(current_dir / "agent" / "mcp_server" / "gmail" / "src" / "gmail" / "gmail_mcp_server.py"),
                     'log_file': 'mcp_gmail_server.log',
                     'args': [],
+                    'max_in_flight': MAX_IN_FLIGHT,
+                    'replicas': 1,  # OAuth token file is not safe to share between processes
+                    'spares': 0,
                     'creds_file_path': str(current_dir / "agent" /  ".google" / "client_creds.json"),
                     'token_path': str(current_dir / "agent"  / ".google" / "app_tokens.json")
                 }
             }
             # Tool registry maps tool names to their server and tool object
             self.tool_registry = {}  # {tool_name: {'server': server_name, 'tool': tool_obj}}
+            # Rendered tool catalogs, valid while tools_version is unchanged
+            self.tools_version = 0
+            self._tool_catalogs: Dict[Any, str] = {}
             
             self._init_lock = threading.Lock()
             self._init_event = threading.Event()
+            self._ready_events = {name: threading.Event() for name in self.servers}
+            self._started = False
             self._session_locks = {name: threading.Lock() for name in self.servers}
-            self._command_queues = {name: Queue() for name in self.servers}
-            self._loops = {}
+            # Each server type runs one or more identical processes; calls are routed
+            # to the least-loaded healthy active replica. Spares are started and
+            # initialized too, but only take traffic once an active replica dies.
+            self.replicas = {
+                name: [
+                    self._new_replica(name, index)
+                    for index in range(config['replicas'] + config['spares'])
+                ]
+                for name, config in self.servers.items()
+            }
+            self.health_check_interval = HEALTH_CHECK_INTERVAL
+            # One event loop, on one thread, owns every ClientSession
+            self._loop: Optional[asyncio.AbstractEventLoop] = None
+            self._loop_lock = threading.Lock()
+
+    def _new_replica(self, server_name: str, index: int) -> Dict[str, Any]:
+        replica_id = f"{server_name}-{index}"
+        return {
+            'id': replica_id,
+            'server': server_name,
+            'initialized': False,
+            'active': False,  # Receives traffic; ready replicas beyond the target count stay on standby
+            'session': None,
+            'tools': None,
+            'startup_seconds': None,  # Spawn to ready, for the most recent start
+            'outstanding': 0,  # Calls routed to this replica and not yet finished
+            'restarts': 0,
+            'scheduler': FairCommandScheduler(replica_id, self.servers[server_name]['max_in_flight'])
+        }
+
+    def _set_replica_state(self, replica: Dict[str, Any], session: Optional[ClientSession], tools=None):
+        """Update a replica and derive its server type's state from all replicas"""
+        server_name = replica['server']
+        with self._session_locks[server_name]:
+            replica['session'] = session
+            replica['initialized'] = session is not None
+            replica['active'] = False
+            if tools is not None:
+                replica['tools'] = tools
+
+            # Keep the configured number of replicas active, promoting warm spares first
+            ready = [r for r in self.replicas[server_name] if r['initialized']]
+            active = [r for r in ready if r['active']]
+            for standby in ready:
+                if len(active) >= self.servers[server_name]['replicas']:
+                    break
+                if not standby['active']:
+                    standby['active'] = True
+                    active.append(standby)
+                    if standby is not replica:
+                        print(f"{standby['id'].upper()} promoted from standby")
+
+            server = self.servers[server_name]
+            server['initialized'] = bool(ready)
+            server['session'] = active[0]['session'] if active else None
+            if tools is not None:
+                server['tools'] = tools
+                self._register_tools(server_name, tools)
+
+            if server['initialized']:
+                self._ready_events[server_name].set()
+            else:
+                self._ready_events[server_name].clear()
+
+            if all(s['initialized'] for s in self.servers.values()):
+                self._init_event.set()
+            else:
+                self._init_event.clear()
             
     def _register_tools(self, server_name: str, tools: list):
-        """Register tools from a server in the tool registry"""
+        """Register tools from a server in the tool registry, invalidating rendered catalogs on change"""
+        registry = {
+            name: info for name, info in self.tool_registry.items() if info['server'] != server_name
+        }
         for tool in tools:
-            self.tool_registry[tool.name] = {
+            registry[tool.name] = {
                 'server': server_name,
                 'tool': tool,
                 'description': getattr(tool, 'description', 'No description')
             }
+
+        def signature(entries):
+            return {
+                name: (info['server'], info['description'], getattr(info['tool'], 'inputSchema', None))
+                for name, info in entries.items()
+            }
+
+        if signature(registry) != signature(self.tool_registry):
+            # Replace rather than mutate, so readers never see a half-updated registry
+            self.tool_registry = registry
+            self._tool_catalogs = {}
+            self.tools_version += 1
+            print(f"Tool catalog updated to version {self.tools_version} ({len(registry)} tools)")
             
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The shared event loop that owns all MCP client sessions, started on first use"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    daemon=True,
+                    name="mcp_service_loop"
+                ).start()
+            return self._loop
+
+    def submit(self, coro) -> Future:
+        """Schedule a coroutine on the shared loop from any thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def _on_service_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def server_params(self, server_name: str, launcher: Optional[str] = None) -> StdioServerParameters:
+        """Build the launch command for a server with the given launcher ("python" or "uv")"""
+        server_config = self.servers[server_name]
+        args = [server_config['script_path']]
+        
+        # Add Gmail-specific arguments if it's the Gmail server
+        if server_name == 'gmail':
+            args.extend([
+                f"--creds-file-path={server_config['creds_file_path']}",
+                f"--token-path={server_config['token_path']}"
+            ])
+        
+        if (launcher or MCP_LAUNCHER) == "uv":
+            return StdioServerParameters(command="uv", args=["run", *args])
+        # The backend runs inside the project environment already, so its interpreter
+        # can start the servers without another environment resolution
+        return StdioServerParameters(command=os.getenv("MCP_PYTHON", sys.executable), args=args)
+
     def _run_mcp_server(self):
-        """Run MCP servers in separate threads"""
-        async def server_loop(server_name: str):
-            server_config = self.servers[server_name]
-            script_path = server_config['script_path']
-            
-            # Build server parameters based on server type
-            base_args = ["run", script_path]
-            
-            # Add Gmail-specific arguments if it's the Gmail server
-            if server_name == 'gmail':
-                base_args.extend([
-                    f"--creds-file-path={server_config['creds_file_path']}",
-                    f"--token-path={server_config['token_path']}"
-                ])
-            
-            server_params = StdioServerParameters(
-                command="uv",
-                args=base_args
-            )
+        """Run every MCP server replica as a task on the shared loop"""
+        async def server_loop(replica: Dict[str, Any]):
+            server_name = replica['server']
+            label = replica['id'].upper()
+            server_params = self.server_params(server_name)
             
             while True:
                 try:
-                    print(f"Starting {server_name.upper()} MCP server connection...")
-                    print(f"Using command: uv {' '.join(base_args)}")  # Debug print
+                    print(f"Starting {label} MCP server connection...")
+                    print(f"Using command: {server_params.command} {' '.join(server_params.args)}")  # Debug print
+                    started = time.monotonic()
                     async with stdio_client(server_params) as (read, write):
-                        print(f"{server_name.upper()} MCP client connected, creating session...")
+                        print(f"{label} MCP client connected, creating session...")
                         async with ClientSession(read, write) as session:
                             try:
-                                print(f"Initializing {server_name.upper()} MCP session...")
+                                print(f"Initializing {label} MCP session...")
                                 await asyncio.wait_for(session.initialize(), timeout=30.0)
-                                print(f"{server_name.upper()} MCP session initialized")
+                                print(f"{label} MCP session initialized")
                                 
-                                # Get and store tools
+                                # Get and store tools, registering them in the tool registry
                                 tools_result = await asyncio.wait_for(session.list_tools(), timeout=30.0)
-                                with self._session_locks[server_name]:
-                                    self.servers[server_name]['session'] = session
-                                    self.servers[server_name]['tools'] = tools_result.tools
-                                    self.servers[server_name]['initialized'] = True
-                                    # Register tools in the tool registry
-                                    self._register_tools(server_name, tools_result.tools)
-                                    print(f"{server_name.upper()} MCP server ready with {len(tools_result.tools)} tools")
-                                    
-                                    # Check if all servers are initialized
-                                    if all(server['initialized'] for server in self.servers.values()):
-                                        self._init_event.set()
+                                replica['startup_seconds'] = time.monotonic() - started
+                                self._set_replica_state(replica, session, tools_result.tools)
+                                print(f"{label} MCP server ready with {len(tools_result.tools)} tools "
+                                      f"in {replica['startup_seconds']:.2f}s ({'active' if replica['active'] else 'standby'})")
                                 
-                                # Keep the session alive and handle requests
-                                while True:
-                                    try:
-                                        # Process any pending commands
-                                        while not self._command_queues[server_name].empty():
-                                            cmd, future = self._command_queues[server_name].get_nowait()
-                                            try:
-                                                # Increase timeout to 120 seconds for long-running operations
-                                                result = await asyncio.wait_for(cmd(session), timeout=120.0)
-                                                future.set_result(result)
-                                            except Exception as e:
-                                                future.set_exception(e)
-                                                print(f"Error executing command on {server_name}: {e}")
-                                        
-                                        # Periodic health check
-                                        await asyncio.wait_for(session.list_tools(), timeout=5.0)
-                                        await asyncio.sleep(1)
-                                    except asyncio.TimeoutError:
-                                        print(f"{server_name.upper()} health check timeout")
-                                        break
-                                    except Exception as e:
-                                        print(f"{server_name.upper()} session health check failed: {e}")
-                                        break
+                                # Commands run as their own tasks on the shared loop;
+                                # this task only watches session health
+                                await self._health_check(label, session)
+                                self._set_replica_state(replica, None)
                                         
                             except asyncio.TimeoutError:
-                                print(f"{server_name.upper()} initialization timeout")
+                                print(f"{label} initialization timeout")
                                 raise
                             except Exception as e:
-                                print(f"{server_name.upper()} session initialization error: {e}")
+                                print(f"{label} session initialization error: {e}")
                                 raise
                                     
                 except Exception as e:
-                    print(f"{server_name.upper()} MCP server error: {str(e)}")
-                    with self._session_locks[server_name]:
-                        self.servers[server_name]['initialized'] = False
-                        self.servers[server_name]['session'] = None
-                        self._init_event.clear()
-                    await asyncio.sleep(5)  # Wait before retrying
-                    
-        def run_async_loop(server_name: str):
-            loop = asyncio.new_event_loop()
-            self._loops[server_name] = loop
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(server_loop(server_name))
+                    print(f"{label} MCP server error: {str(e)}")
+                    self._set_replica_state(replica, None)
+                # Only this replica restarts; its siblings keep serving traffic
+                replica['restarts'] += 1
+                await asyncio.sleep(5)  # Wait before retrying
             
-        # Start each server in its own thread
-        for server_name in self.servers:
-            thread = threading.Thread(
-                target=run_async_loop,
-                args=(server_name,),
-                daemon=True,
-                name=f"{server_name}_server_thread"
-            )
-            thread.start()
+        for replicas in self.replicas.values():
+            for replica in replicas:
+                self.submit(server_loop(replica))
     
-    async def execute_tool(self, tool_name: str, **kwargs) -> Any:
+    async def _health_check(self, label: str, session: ClientSession):
+        """Periodically ping the session; returns when it stops responding"""
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                await asyncio.wait_for(session.list_tools(), timeout=5.0)
+            except asyncio.TimeoutError:
+                print(f"{label} health check timeout")
+                return
+            except Exception as e:
+                print(f"{label} session health check failed: {e}")
+                return
+
+    async def _run_command(self, replica: Dict[str, Any], cmd, session_id: Optional[str] = None):
+        """Run a command against a replica's session; always called on the shared loop"""
+        async def run():
+            session = replica['session']
+            if session is None:
+                raise RuntimeError(f"{replica['id'].upper()} server not initialized")
+            return await asyncio.wait_for(cmd(session), timeout=COMMAND_TIMEOUT)
+
+        try:
+            return await replica['scheduler'].run(session_id, run)
+        except Exception as e:
+            print(f"Error executing command on {replica['id']}: {e}")
+            raise
+
+    def _acquire_replica(self, server_name: str) -> Dict[str, Any]:
+        """Pick the healthy replica with the fewest outstanding calls and reserve a slot on it"""
+        with self._session_locks[server_name]:
+            healthy = [r for r in self.replicas[server_name] if r['initialized'] and r['active']]
+            if not healthy:
+                raise RuntimeError(f"{server_name.upper()} server not initialized")
+            replica = min(healthy, key=lambda r: r['outstanding'])
+            replica['outstanding'] += 1
+            return replica
+
+    def _release_replica(self, replica: Dict[str, Any]):
+        with self._session_locks[replica['server']]:
+            replica['outstanding'] -= 1
+
+    async def execute_tool(self, tool_name: str, session_id: Optional[str] = None, **kwargs) -> Any:
         """Execute a tool by name without needing to know which server it belongs to"""
         if tool_name not in self.tool_registry:
             raise ValueError(f"Unknown tool: {tool_name}")
@@ -187,28 +335,37 @@ class MCPServerManager:
         async def execute(session):
             return await session.execute_tool(tool_name, kwargs)
             
-        return await self.execute_command(server_name, execute)
+        return await self.execute_command(server_name, execute, session_id=session_id)
     
-    async def execute_command(self, server_name: str, cmd):
-        """Execute a command in the specified server thread"""
+    async def execute_command(self, server_name: str, cmd, session_id: Optional[str] = None):
+        """Execute a command on the specified server, scheduled fairly by caller session"""
         if server_name not in self.servers:
             raise ValueError(f"Unknown server: {server_name}")
             
         if not self.servers[server_name]['initialized']:
             raise RuntimeError(f"{server_name.upper()} server not initialized")
             
-        future = Future()
-        self._command_queues[server_name].put((cmd, future))
-        
-        while not future.done():
-            await asyncio.sleep(0.1)
-            
-        return future.result()
+        replica = self._acquire_replica(server_name)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            if self._on_service_loop():
+                result = await self._run_command(replica, cmd, session_id)
+            else:
+                # Callers on another loop hop onto the shared loop once
+                result = await asyncio.wrap_future(self.submit(self._run_command(replica, cmd, session_id)))
+            status = "ok"
+            return result
+        finally:
+            self._release_replica(replica)
+            MCP_COMMAND_SECONDS.observe(time.perf_counter() - start, server=server_name)
+            MCP_COMMANDS_TOTAL.inc(server=server_name, status=status)
     
     def start(self):
         """Start all MCP servers if not already running"""
         with self._init_lock:
-            if not all(server['initialized'] for server in self.servers.values()):
+            if not self._started:
+                self._started = True
                 self._run_mcp_server()
     
     def get_session(self, server_name: str) -> Optional[ClientSession]:
@@ -222,14 +379,60 @@ class MCPServerManager:
     def wait_for_initialization(self, timeout=120):  # Increased timeout to 120 seconds
         """Wait for all servers to initialize"""
         return self._init_event.wait(timeout)
+
+    def wait_for_servers(self, server_names, timeout=120) -> bool:
+        """Wait until each of the given servers has at least one ready replica"""
+        deadline = time.monotonic() + timeout
+        for server_name in server_names:
+            if not self._ready_events[server_name].wait(max(0.0, deadline - time.monotonic())):
+                return False
+        return True
+
+    def get_server_status(self) -> Dict[str, str]:
+        """Readiness of each server type: 'ready' or 'initializing'"""
+        return {
+            name: 'ready' if server['initialized'] else 'initializing'
+            for name, server in self.servers.items()
+        }
     
-    def get_tools_description(self) -> str:
-        """Get formatted description of all available tools"""
-        if not self.tool_registry:
+    def get_tools_description(self, tool_hint: Optional[str] = None) -> str:
+        """
+        Get formatted description of all available tools. With a tool_hint naming
+        known tools, only those tools and the others on their servers are described
+        in full; the rest are listed by name. Renderings are cached per registry version.
+        """
+        # _register_tools swaps the registry before the cache, so reading the cache first
+        # means a stale rendering can only ever land in an already discarded cache
+        catalogs = self._tool_catalogs
+        registry = self.tool_registry
+        if not registry:
             return "No tools available"
-            
+
+        relevant = self._relevant_tools(registry, tool_hint)
+        key = frozenset(relevant) if relevant else None
+        catalog = catalogs.get(key)
+        if catalog is None:
+            catalog = catalogs[key] = self._render_tools(registry, relevant)
+        return catalog
+
+    @staticmethod
+    def _relevant_tools(registry: Dict[str, Any], tool_hint: Optional[str]) -> set:
+        """Tools named in the hint plus the other tools on their servers; empty if none match"""
+        if not tool_hint:
+            return set()
+        # Whole names only, so "add" does not match "address" or "search" match "research";
+        # hyphens count as part of a name so "send-email" still matches
+        hint = tool_hint.lower()
+        servers = {info['server'] for name, info in registry.items()
+                   if re.search(rf"(?<![\w-]){re.escape(name.lower())}(?![\w-])", hint)}
+        return {name for name, info in registry.items() if info['server'] in servers}
+
+    @staticmethod
+    def _render_tools(registry: Dict[str, Any], relevant: set) -> str:
         tool_list = []
-        for name, info in sorted(self.tool_registry.items()):
+        for name, info in sorted(registry.items()):
+            if relevant and name not in relevant:
+                continue
             tool = info['tool']
             desc = [f"- {name}: {info['description']}"]
             
@@ -242,9 +445,30 @@ class MCPServerManager:
                         desc[-1] += " (required)"
                     
             tool_list.extend(desc)
+
+        others = sorted(name for name in registry if relevant and name not in relevant)
+        if others:
+            tool_list.append(f"- Other tools (parameters not shown): {', '.join(others)}")
             
         return "\n".join(tool_list)
 
+    def get_server_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-replica health, queue depth, in-flight and wait-time metrics, grouped by server"""
+        return {
+            name: {
+                replica['id']: {
+                    'healthy': replica['initialized'],
+                    'active': replica['active'],
+                    'startup_seconds': replica['startup_seconds'],
+                    'outstanding': replica['outstanding'],
+                    'restarts': replica['restarts'],
+                    **replica['scheduler'].stats()
+                }
+                for replica in replicas
+            }
+            for name, replicas in self.replicas.items()
+        }
+
     @property
     def initialized(self) -> bool:
         """Check if all servers are initialized"""
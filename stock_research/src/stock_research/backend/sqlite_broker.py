@@ -0,0 +1,342 @@
+"""
+SQLite-backed message broker for running the backend as several processes.
+
+Every worker opens the same database file in WAL mode. Producers append rows to
+a per-session message log and consumers poll it, so an SSE stream served by one
+worker can follow a session whose agent runs in another. Works fully offline.
+A message's sequence number in the log is its event id, so the log doubles as
+the replay buffer for reconnecting consumers.
+
+Messages are written by one writer thread per process, in the order they were
+sent, so producers on the shared MCP loop never wait for the database's write
+lock while other processes hold it.
+"""
+import asyncio
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Optional
+from .message_broker import (
+    BaseMessageBroker,
+    ProcessingSession,
+    REPLAY_BUFFER_SIZE,
+    SESSION_IDLE_TTL,
+    SESSION_CLOSED_TTL
+)
+
+# Seconds between polls while a consumer waits for the next message
+POLL_INTERVAL = 0.05
+CLOSE_SENTINEL = "__close__"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    closed_at REAL,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    expires_at REAL NOT NULL,
+    render_html INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    payload TEXT,
+    PRIMARY KEY (session_id, seq)
+);
+"""
+
+class SQLiteSessionReader:
+    """Reads one session's message log in order; same interface as SessionQueue"""
+
+    def __init__(self, broker: "SQLiteMessageBroker", session_id: str, last_seq: int = 0):
+        self._broker = broker
+        self.session_id = session_id
+        self.last_seq = last_seq
+        self.waiting = 0
+        self.dropped = 0
+        self._last_touch = 0.0
+
+    def __len__(self) -> int:
+        return self._broker._unread_count(self.session_id, self.last_seq)
+
+    @property
+    def bytes(self) -> int:
+        return self._broker._unread_bytes(self.session_id, self.last_seq)
+
+    def _poll(self):
+        """Return (True, message) for the next unread message, or (False, None)"""
+        now = time.time()
+        if now - self._last_touch > 30:
+            self._broker._touch(self.session_id)  # Keep a waiting consumer's session alive
+            self._last_touch = now
+
+        row = self._broker._next_message(self.session_id, self.last_seq)
+        if row is None:
+            return False, None
+        self.last_seq, message_type, payload = row
+        if message_type == CLOSE_SENTINEL:
+            return True, None
+        message = json.loads(payload)
+        message["id"] = self.last_seq
+        return True, message
+
+    def get(self) -> Optional[dict]:
+        """Block the calling thread until a message is available"""
+        self.waiting += 1
+        try:
+            while True:
+                found, message = self._poll()
+                if found:
+                    return message
+                time.sleep(POLL_INTERVAL)
+        finally:
+            self.waiting -= 1
+
+    async def get_async(self) -> Optional[dict]:
+        """Wait without blocking the event loop until a message is available"""
+        self.waiting += 1
+        try:
+            while True:
+                found, message = await asyncio.to_thread(self._poll)
+                if found:
+                    return message
+                await asyncio.sleep(POLL_INTERVAL)
+        finally:
+            self.waiting -= 1
+
+class SQLiteMessageBroker(BaseMessageBroker):
+    """Broker whose sessions are shared by every process opening the same database file"""
+
+    def __init__(self, path: str, idle_ttl: float = SESSION_IDLE_TTL, closed_ttl: float = SESSION_CLOSED_TTL,
+                 replay_size: int = REPLAY_BUFFER_SIZE):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.closed_ttl = closed_ttl
+        self.replay_size = replay_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        if "render_html" not in columns:  # Database created before structured events
+            self._conn.execute("ALTER TABLE sessions ADD COLUMN render_html INTEGER NOT NULL DEFAULT 1")
+        # Message writes go through their own connection, used only by the writer thread
+        self._write_conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._write_conn.execute("PRAGMA synchronous=NORMAL")
+        self._writes: queue.SimpleQueue = queue.SimpleQueue()
+        self._render_html: dict[str, bool] = {}  # Never changes for a session, so read once
+        self._expired = 0
+        self._dropped = 0  # Updates trimmed by this process
+        self._writer_thread = threading.Thread(target=self._write_loop, daemon=True, name="sqlite_broker_writer")
+        self._writer_thread.start()
+        self._cleanup_thread = threading.Thread(target=self._cleanup_old_sessions, daemon=True)
+        self._cleanup_thread.start()
+
+    def _execute(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _write_loop(self):
+        """Run queued writes one at a time, in the order they were submitted"""
+        while True:
+            write, args = self._writes.get()
+            try:
+                write(*args)
+            except Exception as e:
+                print(f"Message broker write failed: {e}")
+
+    def _submit(self, write: Callable, *args):
+        self._writes.put((write, args))
+
+    def _flush(self):
+        """Wait until the writes submitted so far are committed; call off the event loop"""
+        done = threading.Event()
+        self._submit(done.set)
+        done.wait()
+
+    def create_session(self, loop: Optional[asyncio.AbstractEventLoop] = None,
+                       render_html: bool = True) -> ProcessingSession:
+        session_id = str(uuid.uuid4())
+        now = time.time()
+        self._execute(
+            "INSERT INTO sessions (session_id, created_at, expires_at, render_html) VALUES (?, ?, ?, ?)",
+            (session_id, now, now + self.idle_ttl, int(render_html))
+        )
+        self._render_html[session_id] = render_html
+        return ProcessingSession(
+            session_id=session_id,
+            message_queue=SQLiteSessionReader(self, session_id),
+            created_at=datetime.fromtimestamp(now),
+            loop=loop,
+            render_html=render_html
+        )
+
+    def get_session(self, session_id: str) -> Optional[ProcessingSession]:
+        rows = self._execute(
+            "SELECT created_at, closed_at, is_active, render_html FROM sessions WHERE session_id = ?", (session_id,)
+        )
+        if not rows:
+            return None
+        created_at, closed_at, is_active, render_html = rows[0]
+        return ProcessingSession(
+            session_id=session_id,
+            message_queue=SQLiteSessionReader(self, session_id),
+            created_at=datetime.fromtimestamp(created_at),
+            is_active=bool(is_active),
+            closed_at=closed_at,
+            render_html=bool(render_html)
+        )
+
+    def renders_html(self, session_id: str) -> bool:
+        if (cached := self._render_html.get(session_id)) is not None:
+            return cached
+        rows = self._execute("SELECT render_html FROM sessions WHERE session_id = ?", (session_id,))
+        if not rows:
+            return True
+        self._render_html[session_id] = bool(rows[0][0])
+        return self._render_html[session_id]
+
+    def subscribe(self, session_id: str, last_event_id: int = 0,
+                  loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional[SQLiteSessionReader]:
+        if not self._execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)):
+            return None
+        return SQLiteSessionReader(self, session_id, last_event_id)
+
+    def unsubscribe(self, session_id: str, queue: SQLiteSessionReader):
+        pass  # Readers hold no broker state
+
+    def _append(self, session_id: str, message_type: str, payload: Optional[str]):
+        """
+        Append to the session's log, trimming the oldest updates (and partial chunks)
+        past the replay size. A final event deletes the partial chunks it completes.
+        Runs on the writer thread.
+        """
+        conn = self._write_conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not conn.execute(
+                "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone():
+                conn.execute("ROLLBACK")
+                return
+            conn.execute(
+                "INSERT INTO messages (session_id, seq, type, payload) "
+                "SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ? FROM messages WHERE session_id = ?",
+                (session_id, message_type, payload, session_id)
+            )
+            if message_type in ("update", "partial"):
+                trimmed = conn.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND seq IN ("
+                    "  SELECT seq FROM messages WHERE session_id = ? AND type = ?"
+                    "  ORDER BY seq DESC LIMIT -1 OFFSET ?)",
+                    (session_id, session_id, message_type, self.replay_size)
+                ).rowcount
+                if message_type == "update":
+                    self._dropped += trimmed
+            elif message_type == "final":
+                conn.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND type = 'partial'", (session_id,)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _publish(self, session_id: str, message: dict):
+        self._submit(self._append, session_id, message["type"], json.dumps(message))
+
+    def close_session(self, session_id: str):
+        self._render_html.pop(session_id, None)  # Nothing more to render for a closed session
+        self._submit(self._close, session_id, time.time())
+
+    def _close(self, session_id: str, now: float):
+        self._write_conn.execute(
+            "UPDATE sessions SET is_active = 0, closed_at = COALESCE(closed_at, ?), "
+            "expires_at = MIN(expires_at, ?) WHERE session_id = ?",
+            (now, now + self.closed_ttl, session_id)
+        )
+        self._append(session_id, CLOSE_SENTINEL, None)
+
+    def _next_message(self, session_id: str, after_seq: int):
+        rows = self._execute(
+            "SELECT seq, type, payload FROM messages WHERE session_id = ? AND seq > ? ORDER BY seq LIMIT 1",
+            (session_id, after_seq)
+        )
+        return rows[0] if rows else None
+
+    def buffered_messages(self, session_id: str) -> list:
+        self._flush()  # Include this process's messages still queued for writing
+        rows = self._execute(
+            "SELECT seq, payload FROM messages WHERE session_id = ? AND type != ? ORDER BY seq",
+            (session_id, CLOSE_SENTINEL)
+        )
+        return [{**json.loads(payload), "id": seq} for seq, payload in rows]
+
+    def _unread_count(self, session_id: str, after_seq: int) -> int:
+        return self._execute(
+            "SELECT COUNT(*) FROM messages WHERE session_id = ? AND seq > ?", (session_id, after_seq)
+        )[0][0]
+
+    def _unread_bytes(self, session_id: str, after_seq: int) -> int:
+        return self._execute(
+            "SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM messages WHERE session_id = ? AND seq > ?",
+            (session_id, after_seq)
+        )[0][0]
+
+    def _touch(self, session_id: str):
+        """Push back the idle deadline of a session that still has a consumer"""
+        self._execute(
+            "UPDATE sessions SET expires_at = MAX(expires_at, ?) WHERE session_id = ? AND is_active = 1",
+            (time.time() + self.idle_ttl, session_id)
+        )
+
+    def _cleanup_old_sessions(self):
+        """Periodically queue the deletion of expired sessions"""
+        while True:
+            time.sleep(min(self.closed_ttl, 30))
+            self._submit(self._delete_expired, time.time())
+
+    def _delete_expired(self, now: float):
+        """Delete expired sessions and their messages, found through the expires_at index"""
+        conn = self._write_conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM messages WHERE session_id IN "
+                "(SELECT session_id FROM sessions WHERE expires_at < ?)", (now,)
+            )
+            expired = [row[0] for row in conn.execute(
+                "DELETE FROM sessions WHERE expires_at < ? RETURNING session_id", (now,)
+            ).fetchall()]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._expired += len(expired)
+        for session_id in expired:
+            self._render_html.pop(session_id, None)
+
+    def stats(self) -> dict:
+        sessions, active = self._execute(
+            "SELECT COUNT(*), COALESCE(SUM(is_active), 0) FROM sessions"
+        )[0]
+        messages, total_bytes = self._execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM messages"
+        )[0]
+        return {
+            "sessions": sessions,
+            "active_sessions": active,
+            "subscribers": None,  # Readers are not tracked across processes
+            "queued_messages": messages,
+            "queued_bytes": total_bytes,
+            "replay_messages": messages,
+            "dropped_updates": self._dropped,
+            "expired_sessions": self._expired
+        }
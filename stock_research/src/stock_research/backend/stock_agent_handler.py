@@ -4,29 +4,65 @@ from .message_broker import message_broker
 import sys
 import types
 from .server_manager import mcp_server
+from .analysis_pool import AnalysisPool
+from .query_dedup import SingleFlight
+from .answer_cache import create_answer_cache
+from .metrics import QUERIES_TOTAL
 import threading
 from ..agent.userinteraction.userinteraction import user_interaction
 import traceback
+import re
+import os
+import time
+
+# Servers every analysis may need; the extension can accept queries once these are up
+CORE_SERVERS = ('rag', 'math')
+# Agent runs allowed at once on the shared loop, and how many more may wait for a slot
+MAX_CONCURRENT_ANALYSES = int(os.getenv("MAX_CONCURRENT_ANALYSES", "8"))
+MAX_QUEUED_ANALYSES = int(os.getenv("MAX_QUEUED_ANALYSES", "32"))
+analysis_pool = AnalysisPool(MAX_CONCURRENT_ANALYSES, MAX_QUEUED_ANALYSES)
+# Identical queries share one run; completed answers are reused for this many seconds (0 disables)
+QUERY_RESULT_CACHE_TTL = float(os.getenv("QUERY_RESULT_CACHE_TTL", "30"))
+single_flight = SingleFlight(QUERY_RESULT_CACHE_TTL)
+# Persistent answers, matched by query text or embedding; see answer_cache.py for settings
+answer_cache = create_answer_cache(agent.memory.get_embedding)
+
+EMAIL_PATTERN = re.compile(r"\b(e-?mail|gmail|inbox|mail)\b", re.IGNORECASE)
+
+def servers_for_query(query: str) -> list[str]:
+    """Servers whose tools a query is expected to use"""
+    servers = list(CORE_SERVERS)
+    if EMAIL_PATTERN.search(query):
+        servers.append('gmail')
+    return servers
 
 async def process_agent_query(session_id: str, query: str):
     """Process a query using the agent instance"""
+    answer = None
     try:
-        if not mcp_server.initialized:
+        required = servers_for_query(query)
+        pending = [name for name in required if mcp_server.get_server_status()[name] != 'ready']
+        if pending:
             await user_interaction.send_update(
                 session_id=session_id,
                 stage="agent",
-                message="Waiting for server initialization..."
+                message=f"Waiting for {', '.join(pending)} server initialization..."
             )
-            if not mcp_server.wait_for_initialization():
+            if not await asyncio.to_thread(mcp_server.wait_for_servers, pending):
                 raise Exception("Server initialization timeout")
 
         try:
             # Directly pass the server_manager to agent
-            await agent.process_query(
+            answer = await agent.process_query(
                 server_manager=mcp_server,
                 user_input=query,
                 session_id=session_id
             )
+            if answer is not None:
+                try:
+                    await asyncio.to_thread(answer_cache.store, query, answer)
+                except Exception as e:
+                    print(f"Could not cache answer: {e}")
             
         except Exception as e:
             error_details = traceback.format_exc()
@@ -43,11 +79,45 @@ async def process_agent_query(session_id: str, query: str):
             
     finally:
         message_broker.close_session(session_id)
+        # Reads the session back, which may wait on the broker's pending writes
+        await asyncio.to_thread(single_flight.complete, session_id, answer["servers"] if answer else None)
+
+def answer_from_cache(session_id: str, query: str) -> bool:
+    """Stream a cached answer to the session and close it; False when there is none"""
+    try:
+        cached = answer_cache.lookup(query)
+    except Exception as e:
+        print(f"Answer cache lookup failed: {e}")
+        return False
+    if cached is None:
+        return False
+
+    matched = "this question" if cached["match"] == "exact" else f'"{cached["query"]}"'
+    user_interaction.send_step_update(
+        session_id, "agent",
+        f"Answered from an earlier analysis of {matched} ({time.strftime('%Y-%m-%d %H:%M', time.localtime(cached['created_at']))})"
+    )
+    user_interaction.publish_final_result(session_id, cached["summary"], "analysis")
+    QUERIES_TOTAL.inc(outcome="cached")
+    message_broker.close_session(session_id)
+    single_flight.complete(session_id, [])  # Only side-effect-free answers reach the answer cache
+    return True
 
-def start_stock_analysis(session_id: str, query: str):
-    """Start stock analysis in a background thread"""
-    def thread_target():
-        asyncio.run(process_agent_query(session_id, query))
+async def run_stock_analysis(session_id: str, query: str):
+    """Run an admitted analysis once one of the pool's workers is free"""
+    await analysis_pool.run(session_id, lambda: process_agent_query(session_id, query))
 
-    thread = threading.Thread(target=thread_target)
-    thread.start()
\ No newline at end of file
+def start_stock_analysis(session_id: str, query: str) -> bool:
+    """
+    Start stock analysis as a task on the shared MCP loop, next to the sessions it calls.
+    A cached answer is streamed right away instead, without waiting for a pool slot.
+    Returns False, without starting anything, when the pool and its wait queue are full.
+    Blocks on the cache lookup (SQLite and possibly an embedding call), so call it
+    from a worker thread rather than an event loop.
+    """
+    if answer_from_cache(session_id, query):
+        return True
+    if not analysis_pool.try_admit():
+        return False
+    mcp_server.submit(run_stock_analysis(session_id, query))
+    return True
\ No newline at end of file